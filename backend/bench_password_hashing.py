@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Benchmark event-loop latency while bcrypt runs inline vs on the password pool
+"""
+import asyncio
+import os
+import time
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'test_database')
+
+from server import pwd_context, hash_password, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING
+
+LOGINS = int(os.environ.get('BENCH_LOGINS', '8'))
+TICK = 0.005
+
+async def measure_loop_lag(stop: asyncio.Event):
+    """Sample how late a 5 ms timer fires; a blocked loop shows up as large delays"""
+    delays = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK)
+        delays.append(time.perf_counter() - started - TICK)
+    return delays
+
+async def inline_login():
+    pwd_context.hash("benchmark-password")
+
+async def offloaded_login():
+    await hash_password("benchmark-password")
+
+async def run(name: str, login):
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(measure_loop_lag(stop))
+    await asyncio.sleep(TICK * 2)
+    started = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(LOGINS)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    delays = sorted(await sampler)
+    p99 = delays[int(len(delays) * 0.99) - 1] if delays else 0.0
+    print(f"{name:>10}: {LOGINS} hashes in {elapsed * 1000:7.1f} ms | "
+          f"loop lag max {max(delays, default=0) * 1000:7.1f} ms, p99 {p99 * 1000:7.1f} ms, samples {len(delays)}")
+
+async def main():
+    print(f"⏱️  bcrypt event-loop benchmark ({LOGINS} concurrent logins, "
+          f"{PASSWORD_HASH_WORKERS} pool workers, {PASSWORD_HASH_MAX_PENDING} max pending)")
+    await run("inline", inline_login)
+    await run("offloaded", offloaded_login)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+Fail if any registered route query falls back to a collection scan
+"""
+import asyncio
+import sys
+
+from server import client, ensure_indexes, find_collection_scans, QUERY_PLAN_CHECKS
+
+async def check_query_plans():
+    print("🔎 Ensuring indexes...")
+    await ensure_indexes()
+    
+    print(f"🔎 Explaining {len(QUERY_PLAN_CHECKS)} queries...")
+    failures = await find_collection_scans()
+    client.close()
+    
+    if failures:
+        print(f"❌ {len(failures)} queries use a collection scan:")
+        for failure in failures:
+            print(f"   - {failure}")
+        return 1
+    
+    print("✅ Every query is served by an index")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(check_query_plans()))
@@ -1,19 +1,31 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, InsertOne, UpdateOne, DeleteOne, IndexModel, ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Iterable, Callable, Awaitable
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 import uuid
-from datetime import datetime, timezone
+import asyncio
+import time
+import random
+from datetime import datetime, timezone, timedelta
 import jwt
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import httpx
 import hmac
 import hashlib
+import json
+from urllib.parse import quote_from_bytes
+import re
+import base64
 from passlib.context import CryptContext
 
 ROOT_DIR = Path(__file__).parent
@@ -27,6 +39,55 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production-min-32-chars')
 FACEBOOK_APP_SECRET = os.environ.get('FACEBOOK_APP_SECRET', '')
 FACEBOOK_VERIFY_TOKEN = os.environ.get('FACEBOOK_VERIFY_TOKEN', 'my_verify_token_12345')
+BROADCAST_CONCURRENCY = int(os.environ.get('BROADCAST_CONCURRENCY', '20'))
+BROADCAST_BATCH_SIZE = int(os.environ.get('BROADCAST_BATCH_SIZE', '200'))
+BROADCAST_JOB_WORKERS = int(os.environ.get('BROADCAST_JOB_WORKERS', '2'))
+BROADCAST_JOB_LEASE_SECONDS = float(os.environ.get('BROADCAST_JOB_LEASE_SECONDS', '120'))
+BROADCAST_JOB_POLL_SECONDS = float(os.environ.get('BROADCAST_JOB_POLL_SECONDS', '5'))
+AUTOMATION_CACHE_TTL = float(os.environ.get('AUTOMATION_CACHE_TTL', '60'))
+PAGE_CACHE_TTL = float(os.environ.get('PAGE_CACHE_TTL', '300'))
+PAGE_CACHE_SIZE = int(os.environ.get('PAGE_CACHE_SIZE', '10000'))
+PAGE_MISS_CACHE_TTL = float(os.environ.get('PAGE_MISS_CACHE_TTL', '5'))
+SUBSCRIBER_CACHE_SIZE = int(os.environ.get('SUBSCRIBER_CACHE_SIZE', '100000'))
+TOKEN_CACHE_TTL = float(os.environ.get('TOKEN_CACHE_TTL', '60'))
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', '10000'))
+WEBHOOK_QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', '10000'))
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', '8'))
+WEBHOOK_DRAIN_SECONDS = float(os.environ.get('WEBHOOK_DRAIN_SECONDS', '5'))
+WRITE_BATCH_SIZE = int(os.environ.get('WRITE_BATCH_SIZE', '500'))
+WRITE_BATCH_DELAY = float(os.environ.get('WRITE_BATCH_DELAY_MS', '50')) / 1000
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '2'))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', '16'))
+COUNTER_RECONCILE_SECONDS = float(os.environ.get('COUNTER_RECONCILE_SECONDS', '3600'))
+RECEIPT_FLUSH_SECONDS = float(os.environ.get('RECEIPT_FLUSH_SECONDS', '5'))
+RECEIPT_MAX_PENDING = int(os.environ.get('RECEIPT_MAX_PENDING', '10000'))
+RECEIPT_TRACKING_DAYS = float(os.environ.get('RECEIPT_TRACKING_DAYS', '7'))
+INBOX_STREAM_QUEUE_SIZE = int(os.environ.get('INBOX_STREAM_QUEUE_SIZE', '100'))
+INBOX_STREAM_HEARTBEAT_SECONDS = float(os.environ.get('INBOX_STREAM_HEARTBEAT_SECONDS', '15'))
+WORKER_ID = os.environ.get('WORKER_ID') or f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+GRAPH_API_URL = "https://graph.facebook.com/v20.0"
+GRAPH_TIMEOUT = float(os.environ.get('GRAPH_TIMEOUT', '10'))
+GRAPH_CONNECT_TIMEOUT = float(os.environ.get('GRAPH_CONNECT_TIMEOUT', '5'))
+GRAPH_MAX_CONNECTIONS = int(os.environ.get('GRAPH_MAX_CONNECTIONS', '100'))
+GRAPH_MAX_KEEPALIVE = int(os.environ.get('GRAPH_MAX_KEEPALIVE', '20'))
+GRAPH_KEEPALIVE_EXPIRY = float(os.environ.get('GRAPH_KEEPALIVE_EXPIRY', '30'))
+GRAPH_HTTP2 = os.environ.get('GRAPH_HTTP2', 'false').lower() == 'true'
+GRAPH_SEND_RATE = float(os.environ.get('GRAPH_SEND_RATE', '25'))
+GRAPH_SEND_RATE_MIN = float(os.environ.get('GRAPH_SEND_RATE_MIN', '1'))
+GRAPH_SEND_RATE_MAX = float(os.environ.get('GRAPH_SEND_RATE_MAX', '250'))
+GRAPH_SEND_BURST = float(os.environ.get('GRAPH_SEND_BURST', '10'))
+GRAPH_SEND_RETRIES = int(os.environ.get('GRAPH_SEND_RETRIES', '3'))
+GRAPH_RETRY_BASE_SECONDS = float(os.environ.get('GRAPH_RETRY_BASE_SECONDS', '0.5'))
+GRAPH_RETRY_MAX_SECONDS = float(os.environ.get('GRAPH_RETRY_MAX_SECONDS', '8'))
+DEAD_LETTER_REDRIVE_LEASE_SECONDS = float(os.environ.get('DEAD_LETTER_REDRIVE_LEASE_SECONDS', '3600'))
+# Graph accepts at most 50 operations per batch request; 1 sends every message on its own
+GRAPH_BATCH_SIZE = max(1, min(50, int(os.environ.get('GRAPH_BATCH_SIZE', '50'))))
+CIRCUIT_WINDOW = int(os.environ.get('CIRCUIT_WINDOW', '20'))
+CIRCUIT_GLOBAL_WINDOW = int(os.environ.get('CIRCUIT_GLOBAL_WINDOW', '200'))
+CIRCUIT_FAILURE_RATE = float(os.environ.get('CIRCUIT_FAILURE_RATE', '0.5'))
+CIRCUIT_OPEN_SECONDS = float(os.environ.get('CIRCUIT_OPEN_SECONDS', '30'))
+CIRCUIT_HALF_OPEN_PROBES = int(os.environ.get('CIRCUIT_HALF_OPEN_PROBES', '1'))
 
 security = HTTPBearer()
 
@@ -60,6 +121,7 @@ class FacebookPage(BaseModel):
     page_name: str
     page_avatar: Optional[str] = None
     access_token: Optional[str] = None
+    send_concurrency: Optional[int] = None
     is_connected: bool = True
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
 
@@ -68,6 +130,7 @@ class FacebookPageCreate(BaseModel):
     page_name: str
     page_avatar: Optional[str] = None
     access_token: Optional[str] = None
+    send_concurrency: Optional[int] = Field(default=None, ge=1, le=500)
 
 class Subscriber(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -108,6 +171,7 @@ class Flow(BaseModel):
     trigger_type: str
     trigger_value: Optional[str] = None
     steps: List[FlowStep] = []
+    version: int = 1
     is_active: bool = True
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
     updated_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
@@ -144,6 +208,7 @@ class Broadcast(BaseModel):
     delivered_count: int = 0
     read_count: int = 0
     clicked_count: int = 0
+    job_id: Optional[str] = None
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
 
 class BroadcastCreate(BaseModel):
@@ -154,6 +219,30 @@ class BroadcastCreate(BaseModel):
     target_tags: List[str] = []
     scheduled_at: Optional[str] = None
 
+class BroadcastJob(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    broadcast_id: str
+    user_id: str
+    page_id: str
+    status: str = "queued"
+    last_psid: Optional[str] = None
+    pending_batch: Optional[List[str]] = None
+    batches_done: int = 0
+    total_recipients: int = 0
+    sent_count: int = 0
+    failed_count: int = 0
+    skipped_count: int = 0
+    failures: List[Dict[str, Any]] = []
+    duration_seconds: float = 0.0
+    messages_per_second: float = 0.0
+    error: Optional[str] = None
+    lease_owner: Optional[str] = None
+    lease_expires_at: float = 0.0
+    created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+    updated_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+    finished_at: Optional[str] = None
+
 class Automation(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -190,6 +279,64 @@ class MessageCreate(BaseModel):
     message_type: str
     content: Dict[str, Any]
 
+class FanOutResult(BaseModel):
+    total_recipients: int = 0
+    sent_count: int = 0
+    failed_count: int = 0
+    failures: List[Dict[str, Any]] = []
+    duration_seconds: float = 0.0
+    messages_per_second: float = 0.0
+
+    def record(self, recipient: Dict, outcome: Dict):
+        self.total_recipients += 1
+        if outcome.get('success'):
+            self.sent_count += 1
+        else:
+            self.failed_count += 1
+            self.failures.append({"psid": recipient.get('psid'), "error": outcome.get('error')})
+
+    def finish(self, started: float):
+        self.duration_seconds += time.monotonic() - started
+        if self.duration_seconds > 0:
+            self.messages_per_second = round(self.sent_count / self.duration_seconds, 2)
+
+class DeadLetter(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str
+    page_id: str
+    broadcast_id: Optional[str] = None
+    source: str
+    recipient_id: str
+    body: str
+    error: Optional[str] = None
+    code: Optional[int] = None
+    retryable: bool = False
+    attempts: int = 0
+    status: str = "pending"
+    lease_expires_at: float = 0.0
+    created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+    updated_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+
+class DeadLetterRedrive(BaseModel):
+    broadcast_id: Optional[str] = None
+    page_id: Optional[str] = None
+
+class AnalyticsBucket(BaseModel):
+    t: int
+    inbound: int = 0
+    outbound: int = 0
+    new_subscribers: int = 0
+    automation_hits: int = 0
+
+class Analytics(BaseModel):
+    page_id: str
+    granularity: str
+    start: int
+    end: int
+    buckets: List[AnalyticsBucket]
+    totals: Dict[str, int]
+
 class Stats(BaseModel):
     total_subscribers: int
     active_subscribers: int
@@ -197,49 +344,966 @@ class Stats(BaseModel):
     total_broadcasts: int
     total_flows: int
 
+# Indexes
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("email", ASCENDING)], unique=True),
+        IndexModel([("id", ASCENDING)], unique=True),
+    ],
+    "facebook_pages": [
+        IndexModel([("page_id", ASCENDING)]),
+        IndexModel([("user_id", ASCENDING)]),
+        IndexModel([("id", ASCENDING)]),
+    ],
+    "subscribers": [
+        IndexModel([("page_id", ASCENDING), ("psid", ASCENDING)], unique=True),
+        IndexModel([("user_id", ASCENDING), ("page_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)]),
+        IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)]),
+        IndexModel([("page_id", ASCENDING), ("subscribed", ASCENDING), ("psid", ASCENDING)]),
+        IndexModel([("id", ASCENDING)]),
+    ],
+    "messages": [
+        IndexModel([("subscriber_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)]),
+        IndexModel([("page_id", ASCENDING)]),
+    ],
+    "flows": [
+        IndexModel([("user_id", ASCENDING), ("page_id", ASCENDING)]),
+        IndexModel([("id", ASCENDING)]),
+    ],
+    "broadcasts": [
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)]),
+        IndexModel([("user_id", ASCENDING), ("page_id", ASCENDING), ("created_at", DESCENDING)]),
+        IndexModel([("id", ASCENDING)]),
+    ],
+    "broadcast_jobs": [
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)]),
+        IndexModel([("broadcast_id", ASCENDING), ("created_at", DESCENDING)]),
+        IndexModel([("id", ASCENDING)]),
+    ],
+    "broadcast_messages": [
+        IndexModel([("mid", ASCENDING)], unique=True),
+        IndexModel([("broadcast_id", ASCENDING), ("psid", ASCENDING)]),
+        IndexModel([("page_id", ASCENDING), ("psid", ASCENDING), ("read", ASCENDING)]),
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "flow_sessions": [
+        IndexModel([("page_id", ASCENDING), ("psid", ASCENDING)], unique=True),
+    ],
+    "counters": [
+        IndexModel([("key", ASCENDING)], unique=True),
+        IndexModel([("user_id", ASCENDING), ("page_id", ASCENDING)]),
+    ],
+    "analytics": [
+        IndexModel([("page_id", ASCENDING), ("granularity", ASCENDING), ("bucket", ASCENDING)], unique=True),
+    ],
+    "dead_letters": [
+        IndexModel([("user_id", ASCENDING), ("broadcast_id", ASCENDING), ("status", ASCENDING)]),
+        IndexModel([("user_id", ASCENDING), ("page_id", ASCENDING), ("status", ASCENDING)]),
+        IndexModel([("redrive_id", ASCENDING)]),
+        IndexModel([("broadcast_id", ASCENDING), ("recipient_id", ASCENDING)]),
+    ],
+    "automations": [
+        IndexModel([("page_id", ASCENDING), ("is_active", ASCENDING), ("type", ASCENDING), ("created_at", ASCENDING)]),
+        IndexModel([("user_id", ASCENDING), ("page_id", ASCENDING)]),
+        IndexModel([("id", ASCENDING)]),
+    ],
+}
+
+# Representative filters/sorts of the queries routes and workers run; each must be served by an index
+QUERY_PLAN_CHECKS = [
+    ("auth: user by email", "users", {"email": "x"}, None),
+    ("auth: user by id", "users", {"id": "x"}, None),
+    ("pages: by page_id", "facebook_pages", {"page_id": "x"}, None),
+    ("pages: list", "facebook_pages", {"user_id": "x"}, None),
+    ("pages: by id", "facebook_pages", {"id": "x", "user_id": "x"}, None),
+    ("webhook: subscriber by psid", "subscribers", {"page_id": "x", "psid": "x"}, None),
+    ("subscribers: list", "subscribers", {"user_id": "x"}, [("created_at", 1), ("id", 1)]),
+    ("subscribers: list by page", "subscribers", {"user_id": "x", "page_id": "x"}, [("created_at", 1), ("id", 1)]),
+    ("subscribers: by id", "subscribers", {"id": "x", "user_id": "x"}, None),
+    ("broadcast: audience", "subscribers", {"page_id": "x", "subscribed": True, "psid": {"$gt": "x"}}, [("psid", 1)]),
+    ("messages: latest", "messages", {"subscriber_id": "x"}, [("created_at", -1), ("id", -1)]),
+    ("messages: since", "messages", {"subscriber_id": "x", "created_at": {"$gt": "x"}}, [("created_at", 1), ("id", 1)]),
+    ("receipts: delivered mids", "broadcast_messages", {"mid": {"$in": ["x", "y"]}, "delivered": False}, None),
+    ("receipts: unread by psid", "broadcast_messages", {"page_id": "x", "psid": {"$in": ["x", "y"]}, "read": False}, None),
+    ("stats: counters", "counters", {"key": "x"}, None),
+    ("reconcile: counter pages", "counters", {"user_id": "x", "page_id": {"$ne": None}}, None),
+    ("reconcile: active subscribers", "subscribers", {"user_id": "x", "page_id": "x", "subscribed": True}, None),
+    ("reconcile: messages by page", "messages", {"page_id": "x"}, None),
+    ("analytics: range", "analytics", {"page_id": "x", "granularity": "hour", "bucket": {"$gte": 0, "$lt": 1}}, None),
+    ("flows: list", "flows", {"user_id": "x", "page_id": "x"}, None),
+    ("flows: by id", "flows", {"id": "x", "user_id": "x"}, None),
+    ("automations: snapshot flows", "flows", {"id": {"$in": ["x", "y"]}}, None),
+    ("flow runtime: flow by id", "flows", {"id": "x"}, None),
+    ("flow runtime: session", "flow_sessions", {"page_id": "x", "psid": "x"}, None),
+    ("broadcasts: list", "broadcasts", {"user_id": "x"}, [("created_at", -1)]),
+    ("broadcasts: list by page", "broadcasts", {"user_id": "x", "page_id": "x"}, [("created_at", -1)]),
+    ("broadcasts: by id", "broadcasts", {"id": "x", "user_id": "x"}, None),
+    ("broadcast jobs: claim", "broadcast_jobs", {"status": {"$in": ["queued", "sending"]}, "lease_expires_at": {"$lt": 0}}, [("created_at", 1)]),
+    ("broadcast jobs: latest", "broadcast_jobs", {"broadcast_id": "x", "user_id": "x"}, [("created_at", -1)]),
+    ("broadcast jobs: by id", "broadcast_jobs", {"id": "x"}, None),
+    ("dead letters: by broadcast", "dead_letters", {"user_id": "x", "broadcast_id": "x", "status": "pending"}, None),
+    ("dead letters: by page", "dead_letters", {"user_id": "x", "page_id": "x", "status": "pending"}, None),
+    ("dead letters: redrive batch", "dead_letters", {"redrive_id": "x"}, None),
+    ("broadcast jobs: resume sent", "broadcast_messages", {"broadcast_id": "x", "psid": {"$in": ["x", "y"]}}, None),
+    ("broadcast jobs: resume failed", "dead_letters", {"broadcast_id": "x", "source": "broadcast", "recipient_id": {"$in": ["x", "y"]}}, None),
+    ("automations: snapshot", "automations", {"page_id": "x", "is_active": True, "type": "keyword"}, [("created_at", 1)]),
+    ("automations: list", "automations", {"user_id": "x", "page_id": "x"}, None),
+    ("automations: by id", "automations", {"id": "x", "user_id": "x"}, None),
+]
+
+async def ensure_indexes():
+    """Create every index in INDEXES one by one; existing indexes are left untouched.
+
+    A unique index that cannot be built (e.g. over legacy duplicates) is a
+    startup error, since inserts rely on it to reject duplicates.
+    """
+    failed_unique = []
+    for collection, indexes in INDEXES.items():
+        for index in indexes:
+            name = f"{collection}.{index.document['name']}"
+            try:
+                await db[collection].create_indexes([index])
+            except Exception as e:
+                logging.error(f"Could not create index {name}: {e}")
+                if index.document.get("unique"):
+                    failed_unique.append(name)
+    if failed_unique:
+        raise RuntimeError(f"Unique indexes could not be built, deduplicate first: {', '.join(failed_unique)}")
+
+def _plan_stages(plan: Dict):
+    yield plan.get("stage")
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _plan_stages(child)
+
+async def find_collection_scans() -> List[str]:
+    """Run `explain` on every QUERY_PLAN_CHECKS entry and name the ones whose winning plan is a COLLSCAN"""
+    failures = []
+    for name, collection, query, sort in QUERY_PLAN_CHECKS:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explanation = await cursor.explain()
+        winning_plan = explanation["queryPlanner"]["winningPlan"]
+        if "COLLSCAN" in _plan_stages(winning_plan):
+            failures.append(f"{name} ({collection} {query})")
+    return failures
+
+# Caching
+class TTLCache:
+    """Bounded in-process LRU cache whose entries expire after `ttl` seconds"""
+
+    _MISSING = object()
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key, self._MISSING)
+        if entry is self._MISSING:
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, self._MISSING) is not self._MISSING
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        self._data.pop(key, None)
+
+    def discard_where(self, predicate: Callable[[Any], bool]):
+        for key in [key for key, (_, value) in self._data.items() if predicate(value)]:
+            del self._data[key]
+
+    def clear(self):
+        self._data.clear()
+
 # Helper functions
 def create_token(user_id: str):
     payload = {"user_id": user_id, "exp": datetime.now(timezone.utc).timestamp() + 86400 * 30}
     return jwt.encode(payload, SECRET_KEY, algorithm="HS256")
 
-def verify_token(token: str):
+def decode_token(token: str):
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-        return payload["user_id"]
+        return jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
     except:
         return None
 
+# bcrypt is CPU-bound: run it on a small dedicated pool so it never blocks the event loop
+_password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password")
+_password_slots: Optional[asyncio.Semaphore] = None
+
+async def run_password_task(func: Callable, *args):
+    """Run a password hash/verify on the password pool, shedding load once PASSWORD_HASH_MAX_PENDING are queued"""
+    global _password_slots
+    if _password_slots is None:
+        _password_slots = asyncio.Semaphore(PASSWORD_HASH_MAX_PENDING)
+    if _password_slots.locked():
+        raise HTTPException(status_code=503, detail="Too many authentication requests, retry shortly", headers={"Retry-After": "1"})
+    async with _password_slots:
+        return await asyncio.get_running_loop().run_in_executor(_password_executor, func, *args)
+
+async def hash_password(password: str) -> str:
+    return await run_password_task(pwd_context.hash, password)
+
+async def verify_password(password: str, hashed: str) -> bool:
+    return await run_password_task(pwd_context.verify, password, hashed)
+
+# Verified token -> User, so hot sessions skip both the JWT check and the user lookup
+_token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
+
+def invalidate_user_cache(user_id: str):
+    """Drop cached sessions of a user; call after changing or deleting the user document"""
+    _token_cache.discard_where(lambda user: user.id == user_id)
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
-    user_id = verify_token(token)
-    if not user_id:
+    return await authenticate_token(credentials.credentials)
+
+async def authenticate_token(token: str) -> User:
+    user = _token_cache.get(token)
+    if user is not None:
+        return user
+    payload = decode_token(token)
+    if not payload or not payload.get("user_id"):
         raise HTTPException(status_code=401, detail="Invalid token")
-    user = await db.users.find_one({"id": user_id}, {"_id": 0})
+    user = await db.users.find_one({"id": payload["user_id"]}, {"_id": 0, "password": 0})
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
-    return User(**user)
+    user = User(**user)
+    # Never serve a token from cache past its expiry
+    _token_cache.set(token, user, ttl=payload.get("exp", 0) - datetime.now(timezone.utc).timestamp())
+    return user
+
+# Write batching
+class WriteBatcher:
+    """Group-commit buffer flushing queued writes as one unordered bulk_write per collection; same-`key` writes collapse"""
+
+    def __init__(self, max_size: int, max_delay: float):
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self._pending: Dict[str, OrderedDict] = {}
+        self._count = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushing: set = set()
+        # A scheduled flush that has not taken the buffer yet; it will also take later adds
+        self._flush_scheduled = False
+        # One flush at a time, so a later write to a key never lands before an earlier one
+        self._flush_lock = asyncio.Lock()
+
+    def add(self, collection: str, operation, key=None) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        ops = self._pending.setdefault(collection, OrderedDict())
+        key = key if key is not None else object()
+        previous = ops.pop(key, None)
+        if previous is None:
+            self._count += 1
+        else:
+            self._chain(future, previous[1])
+        ops[key] = (operation, future)
+        if self._count >= self.max_size:
+            self._schedule_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._schedule_flush)
+        return future
+
+    def increment(self, collection: str, query: Dict, deltas: Dict[str, int], set_on_insert: Optional[Dict] = None) -> asyncio.Future:
+        """Queue an upserting $inc, merged with any pending increment of the same document"""
+        key = ("$inc", tuple(sorted(query.items())))
+        previous = self._pending.get(collection, {}).get(key)
+        merged = dict(deltas)
+        set_on_insert = dict(set_on_insert or {})
+        if previous is not None:
+            for field, value in previous[0]["$inc"].items():
+                merged[field] = merged.get(field, 0) + value
+            set_on_insert = {**previous[0]["$setOnInsert"], **set_on_insert}
+        return self.add(collection, {"query": query, "$inc": merged, "$setOnInsert": set_on_insert}, key=key)
+
+    @staticmethod
+    def _as_operation(operation):
+        if isinstance(operation, dict):
+            update = {"$inc": operation["$inc"]}
+            if operation["$setOnInsert"]:
+                update["$setOnInsert"] = operation["$setOnInsert"]
+            return UpdateOne(operation["query"], update, upsert=True)
+        return operation
+
+    @staticmethod
+    def _chain(source: asyncio.Future, target: asyncio.Future):
+        """Resolve a replaced operation's future together with its replacement"""
+        def done(f):
+            if target.done():
+                return
+            if f.exception():
+                target.set_exception(f.exception())
+            else:
+                target.set_result(f.result())
+        source.add_done_callback(done)
+
+    def _schedule_flush(self):
+        if self._flush_scheduled:
+            return
+        self._flush_scheduled = True
+        task = asyncio.ensure_future(self.flush())
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+
+    async def flush(self):
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending, self._count = self._pending, {}, 0
+        self._flush_scheduled = False
+        for collection, ops in pending.items():
+            operations = [self._as_operation(operation) for operation, _ in ops.values()]
+            futures = [future for _, future in ops.values()]
+            try:
+                result = await db[collection].bulk_write(operations, ordered=False)
+            except Exception as e:
+                logging.error(f"Batched write to {collection} failed ({len(operations)} ops): {e}")
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+                        future.exception()  # mark retrieved for fire-and-forget writes
+                continue
+            for future in futures:
+                if not future.done():
+                    future.set_result(result)
+
+    async def close(self):
+        await asyncio.gather(*self._flushing, return_exceptions=True)
+        await self.flush()
+
+write_batcher = WriteBatcher(max_size=WRITE_BATCH_SIZE, max_delay=WRITE_BATCH_DELAY)
+
+# Graph API client
+_graph_client: Optional[httpx.AsyncClient] = None
+
+def create_graph_client() -> httpx.AsyncClient:
+    """Build the keep-alive pooled client shared by all Graph API calls"""
+    http2 = GRAPH_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logging.warning("GRAPH_HTTP2 is enabled but the 'h2' package is not installed; using HTTP/1.1")
+            http2 = False
+    return httpx.AsyncClient(
+        base_url=GRAPH_API_URL,
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=GRAPH_MAX_CONNECTIONS,
+            max_keepalive_connections=GRAPH_MAX_KEEPALIVE,
+            keepalive_expiry=GRAPH_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(GRAPH_TIMEOUT, connect=GRAPH_CONNECT_TIMEOUT),
+    )
+
+def get_graph_client() -> httpx.AsyncClient:
+    global _graph_client
+    if _graph_client is None or _graph_client.is_closed:
+        _graph_client = create_graph_client()
+    return _graph_client
+
+# Graph API rate limiting
+# Error codes Graph returns when an app, user or page is being throttled
+GRAPH_THROTTLE_CODES = {4, 17, 32, 613}
+GRAPH_USAGE_HEADERS = ("x-app-usage", "x-page-usage", "x-business-use-case-usage")
+
+def graph_error(response: httpx.Response) -> Dict:
+    """The `error` object of a failed Graph response, or {} if the body has none"""
+    try:
+        error = response.json().get("error")
+    except ValueError:
+        return {}
+    return error if isinstance(error, dict) else {}
+
+def graph_usage(response: httpx.Response) -> tuple:
+    """(highest usage percentage, seconds until access is regained) reported by the usage headers"""
+    usage, regain = 0.0, 0.0
+    for header in GRAPH_USAGE_HEADERS:
+        raw = response.headers.get(header)
+        if not raw:
+            continue
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            continue
+        # X-App-Usage / X-Page-Usage are one object; X-Business-Use-Case-Usage maps ids to lists of them
+        entries = [data] if header != "x-business-use-case-usage" else [
+            entry for entries in data.values() for entry in entries
+        ]
+        for entry in entries:
+            usage = max(usage, *(float(entry.get(key) or 0) for key in ("call_count", "total_time", "total_cputime")))
+            regain = max(regain, float(entry.get("estimated_time_to_regain_access") or 0) * 60)
+    return usage, regain
+
+class SendRateLimiter:
+    """Token bucket for one page access token whose rate adapts to Graph's throttling feedback.
+
+    The rate grows additively while usage stays low and is halved on throttling
+    errors or high usage headers; an announced regain time pauses the bucket.
+    """
+
+    def __init__(self, rate: float = GRAPH_SEND_RATE, burst: float = GRAPH_SEND_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    async def acquire(self, count: int = 1):
+        """Take `count` tokens; a batch request costs one per operation"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        # Reserve tokens even when the bucket is empty; the debt is the wait
+        self.tokens -= count
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+    def slow_down(self, pause: float = 0.0):
+        self.rate = max(GRAPH_SEND_RATE_MIN, self.rate / 2)
+        if pause:
+            self.tokens = min(self.tokens, -pause * self.rate)
+
+    def observe(self, response: httpx.Response):
+        """Adapt the rate to a Graph response's error code and usage headers"""
+        usage, regain = graph_usage(response)
+        throttled = response.status_code != 200 and graph_error(response).get("code") in GRAPH_THROTTLE_CODES
+        if throttled or usage >= 90 or regain:
+            self.slow_down(pause=regain or (1.0 if throttled else 0.0))
+        elif usage < 50 and response.status_code == 200:
+            self.rate = min(GRAPH_SEND_RATE_MAX, self.rate + 1)
+
+_send_rate_limiters: Dict[str, SendRateLimiter] = {}
+
+def get_send_rate_limiter(page_id: str) -> SendRateLimiter:
+    """Limiter shared by every send of a page; keyed by page id so it survives token rotation"""
+    limiter = _send_rate_limiters.get(page_id)
+    if limiter is None:
+        limiter = _send_rate_limiters[page_id] = SendRateLimiter()
+    return limiter
+
+# Circuit breakers
+class CircuitBreaker:
+    """closed -> open when CIRCUIT_FAILURE_RATE of recent calls failed; open -> half_open probes after CIRCUIT_OPEN_SECONDS"""
+
+    def __init__(self, window: int = CIRCUIT_WINDOW):
+        self.state = "closed"
+        self.outcomes = deque(maxlen=window)
+        self.opened_at = 0.0
+        self.probes = 0
+        self.probe_started_at = 0.0
+        self.trips = 0
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        if self.state == "open":
+            if now - self.opened_at < CIRCUIT_OPEN_SECONDS:
+                return False
+            self.state, self.probes = "half_open", 0
+        if self.state == "half_open":
+            # A probe that never reported back (cancelled send) must not wedge the breaker
+            if self.probes >= CIRCUIT_HALF_OPEN_PROBES and now - self.probe_started_at < GRAPH_TIMEOUT * 2:
+                return False
+            if self.probes >= CIRCUIT_HALF_OPEN_PROBES:
+                self.probes = 0
+            self.probes += 1
+            self.probe_started_at = now
+        return True
+
+    def release(self):
+        """Give back a half-open probe slot taken by allow() for a call that was not made"""
+        if self.state == "half_open" and self.probes:
+            self.probes -= 1
+
+    def record(self, ok: bool):
+        if self.state == "half_open":
+            if ok:
+                self.state = "closed"
+                self.outcomes.clear()
+            else:
+                self.trip()
+        elif self.state == "closed":
+            self.outcomes.append(ok)
+            failures = len(self.outcomes) - sum(self.outcomes)
+            if len(self.outcomes) * 2 >= self.outcomes.maxlen and failures >= CIRCUIT_FAILURE_RATE * len(self.outcomes):
+                self.trip()
+
+    def trip(self):
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.outcomes.clear()
+        self.trips += 1
+
+    def retry_in(self) -> float:
+        """Seconds until an open breaker lets a probe through"""
+        if self.state != "open":
+            return 0.0
+        return max(0.0, self.opened_at + CIRCUIT_OPEN_SECONDS - time.monotonic())
+
+    def status(self) -> Dict:
+        return {
+            "state": self.state,
+            "retry_in_seconds": round(self.retry_in(), 1),
+            "recent_calls": len(self.outcomes),
+            "recent_failures": len(self.outcomes) - sum(self.outcomes),
+            "trips": self.trips
+        }
+
+global_circuit = CircuitBreaker(window=CIRCUIT_GLOBAL_WINDOW)
+_page_circuits: Dict[str, CircuitBreaker] = {}
+
+def get_page_circuit(page_id: str) -> CircuitBreaker:
+    """Breaker shared by every send of a page"""
+    circuit = _page_circuits.get(page_id)
+    if circuit is None:
+        circuit = _page_circuits[page_id] = CircuitBreaker()
+    return circuit
+
+def send_circuit_retry_in(page_id: str) -> float:
+    """Seconds until sends of this page may be attempted again; 0 when neither breaker is open"""
+    return max(global_circuit.retry_in(), get_page_circuit(page_id).retry_in())
 
 # Send message to Facebook
-async def send_facebook_message(recipient_id: str, message_data: Dict, page_access_token: str):
-    """Send message via Facebook Messenger API"""
-    url = "https://graph.facebook.com/v20.0/me/messages"
+def encode_message(message_data: Dict) -> bytes:
+    """Serialize a Messenger `message` object into the bytes spliced into a send request"""
+    return json.dumps(message_data, separators=(',', ':'), ensure_ascii=False).encode()
+
+def is_retryable_send_error(status_code: Optional[int], error: Dict) -> bool:
+    """Transient failures worth retrying: transport errors, 5xx, throttling and errors Graph marks transient"""
+    if status_code is None or status_code >= 500:
+        return True
+    # 1/2: unknown error / service temporarily unavailable
+    return bool(error.get("is_transient")) or error.get("code") in GRAPH_THROTTLE_CODES | {1, 2}
+
+def retry_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff before retry number `attempt` (0-based)"""
+    return random.uniform(0, min(GRAPH_RETRY_MAX_SECONDS, GRAPH_RETRY_BASE_SECONDS * 2 ** attempt))
+
+def circuit_refusal(page_circuit: CircuitBreaker) -> Optional[str]:
+    """Why a send may not be attempted now, or None when both breakers let it through"""
+    if not global_circuit.allow():
+        return "Circuit open: Graph API"
+    if not page_circuit.allow():
+        global_circuit.release()
+        return "Circuit open: page"
+    return None
+
+def record_circuit_outcome(page_circuit: CircuitBreaker, response: Optional[httpx.Response]):
+    # Only transport errors and 5xx say Graph is unhealthy; 4xx are about this request
+    healthy = response is not None and response.status_code < 500
+    global_circuit.record(healthy)
+    page_circuit.record(healthy)
+
+def send_failure(message: str, error: Dict, retryable: bool, attempts: int) -> Dict:
+    return {"success": False, "error": message, "code": error.get("code"), "retryable": retryable, "attempts": attempts}
+
+def store_dead_letter(recipient_id: str, message_body: bytes, result: Dict, dead_letter: Dict):
+    write_batcher.add("dead_letters", InsertOne(DeadLetter(
+        recipient_id=recipient_id,
+        body=message_body.decode(),
+        error=result["error"],
+        code=result["code"],
+        retryable=result["retryable"],
+        attempts=result["attempts"],
+        **dead_letter
+    ).model_dump()))
+
+async def send_message_body(
+    recipient_id: str,
+    message_body: bytes,
+    page: Dict,
+    dead_letter: Optional[Dict] = None,
+):
+    """Send an already serialized `message` object as `page` (its page_id and access_token) via Facebook Messenger API.
+
+    Retryable failures are retried with backoff up to GRAPH_SEND_RETRIES times.
+    If the send still fails and `dead_letter` is given (user_id, page_id,
+    source, optional broadcast_id), the rendered body is kept in dead_letters
+    so it can be re-driven later.
+    """
+    content = b'{"recipient":{"id":' + json.dumps(recipient_id).encode() + b'},"message":' + message_body + b'}'
+    params = {"access_token": page['access_token']}
+    limiter = get_send_rate_limiter(page['page_id'])
+    page_circuit = get_page_circuit(page['page_id'])
     
-    payload = {
-        "recipient": {"id": recipient_id},
-        "message": message_data
-    }
+    for attempt in range(GRAPH_SEND_RETRIES + 1):
+        response, error = None, {}
+        refusal = circuit_refusal(page_circuit)
+        if refusal:
+            result = send_failure(refusal, error, True, attempt + 1)
+            break
+        try:
+            await limiter.acquire()
+            response = await get_graph_client().post(
+                "/me/messages", params=params, content=content, headers={"Content-Type": "application/json"}
+            )
+            limiter.observe(response)
+        except Exception as e:
+            message = str(e) or type(e).__name__
+        record_circuit_outcome(page_circuit, response)
+        if response is not None:
+            if response.status_code == 200:
+                return {"success": True, "data": response.json(), "attempts": attempt + 1}
+            error = graph_error(response)
+            message = response.text
+        retryable = is_retryable_send_error(response.status_code if response is not None else None, error)
+        result = send_failure(message, error, retryable, attempt + 1)
+        if not retryable or attempt == GRAPH_SEND_RETRIES:
+            break
+        await asyncio.sleep(retry_delay(attempt))
     
-    params = {"access_token": page_access_token}
+    if dead_letter is not None:
+        store_dead_letter(recipient_id, message_body, result, dead_letter)
+    return result
+
+def batch_operation(recipient_id: str, message_body: bytes) -> Dict:
+    """One /me/messages call of a Graph batch request; its body is form-encoded"""
+    recipient = b'{"id":' + json.dumps(recipient_id).encode() + b'}'
+    return {
+        "method": "POST",
+        "relative_url": "me/messages",
+        "body": "recipient=" + quote_from_bytes(recipient, safe='') + "&message=" + quote_from_bytes(message_body, safe='')
+    }
+
+async def send_message_batch(
+    messages: List[tuple],
+    page: Dict,
+    dead_letter: Optional[Dict] = None,
+) -> List[Dict]:
+    """Send (recipient_id, message_body) pairs in Graph batch requests of up to GRAPH_BATCH_SIZE.
+
+    Returns one send_message_body-style result per message, in order. Retryable
+    operations are re-batched with backoff; rate limiting, circuit breakers and
+    dead letters apply as for single sends.
+    """
+    if GRAPH_BATCH_SIZE == 1 or len(messages) == 1:
+        # A one-operation batch only adds overhead over the plain Send API call
+        return [
+            await send_message_body(recipient_id, message_body, page, dead_letter)
+            for recipient_id, message_body in messages
+        ]
+    results: List[Optional[Dict]] = [None] * len(messages)
+    for start in range(0, len(messages), GRAPH_BATCH_SIZE):
+        await _send_batch_chunk(messages, range(start, min(start + GRAPH_BATCH_SIZE, len(messages))), results, page)
+    if dead_letter is not None:
+        for (recipient_id, message_body), result in zip(messages, results):
+            if not result["success"]:
+                store_dead_letter(recipient_id, message_body, result, dead_letter)
+    return results
+
+async def _send_batch_chunk(messages: List[tuple], indexes: Iterable[int], results: List, page: Dict):
+    limiter = get_send_rate_limiter(page['page_id'])
+    page_circuit = get_page_circuit(page['page_id'])
+    pending = list(indexes)
     
-    async with httpx.AsyncClient() as client:
+    for attempt in range(GRAPH_SEND_RETRIES + 1):
+        response, error, operations = None, {}, None
+        refusal = circuit_refusal(page_circuit)
+        if refusal:
+            for i in pending:
+                results[i] = send_failure(refusal, error, True, attempt + 1)
+            return
+        batch = json.dumps([batch_operation(*messages[i]) for i in pending], separators=(',', ':'))
         try:
-            response = await client.post(url, params=params, json=payload, timeout=10.0)
+            await limiter.acquire(len(pending))
+            response = await get_graph_client().post(
+                "/", data={"access_token": page['access_token'], "include_headers": "false", "batch": batch}
+            )
+            limiter.observe(response)
             if response.status_code == 200:
-                return {"success": True, "data": response.json()}
+                operations = response.json()
             else:
-                return {"success": False, "error": response.text}
+                error = graph_error(response)
+                message = response.text
+        except Exception as e:
+            message = str(e) or type(e).__name__
+        record_circuit_outcome(page_circuit, response)
+        
+        retry = []
+        if operations is None:
+            # The batch request itself failed, so every operation in it did
+            retryable = is_retryable_send_error(response.status_code if response is not None else None, error)
+            for i in pending:
+                results[i] = send_failure(message, error, retryable, attempt + 1)
+            retry = pending if retryable else []
+        else:
+            throttled = False
+            for i, operation in zip(pending, operations):
+                if operation and operation.get("code") == 200:
+                    results[i] = {"success": True, "data": json.loads(operation["body"]), "attempts": attempt + 1}
+                    continue
+                # A null entry is an operation Graph did not get to (e.g. the batch timed out)
+                status_code = operation.get("code") if operation else None
+                try:
+                    op_error = json.loads(operation["body"]).get("error") or {} if operation else {}
+                except (ValueError, TypeError):
+                    op_error = {}
+                throttled = throttled or op_error.get("code") in GRAPH_THROTTLE_CODES
+                retryable = is_retryable_send_error(status_code, op_error)
+                message = operation.get("body") if operation else "Batch operation not processed"
+                results[i] = send_failure(message, op_error, retryable, attempt + 1)
+                if retryable:
+                    retry.append(i)
+            if throttled:
+                limiter.slow_down(pause=1.0)
+        
+        pending = retry
+        if not pending or attempt == GRAPH_SEND_RETRIES:
+            return
+        await asyncio.sleep(retry_delay(attempt))
+
+# Broadcast fan-out
+_page_send_limits: Dict[str, tuple] = {}
+
+def get_page_send_semaphore(page: Dict) -> asyncio.Semaphore:
+    """Shared per-page limit on in-flight sends, across all broadcasts of that page"""
+    limit = page.get('send_concurrency') or BROADCAST_CONCURRENCY
+    current = _page_send_limits.get(page['page_id'])
+    if current is None or current[0] != limit:
+        current = (limit, asyncio.Semaphore(limit))
+        _page_send_limits[page['page_id']] = current
+    return current[1]
+
+async def fan_out_batches(
+    recipients: List[Dict],
+    send_batch: Callable[[List[Dict]], Awaitable[List[Dict]]],
+    semaphore: asyncio.Semaphore,
+    batch_size: int = GRAPH_BATCH_SIZE,
+    workers: int = BROADCAST_CONCURRENCY,
+    result: Optional[FanOutResult] = None,
+) -> FanOutResult:
+    """Send to every recipient in chunks of `batch_size`, with at most `semaphore` chunks in flight.
+
+    `send_batch` returns one outcome per recipient of its chunk. A fixed pool of
+    workers drains the chunks, so the number of pending tasks is bounded by the
+    concurrency limit, not the audience size.
+    """
+    result = result or FanOutResult()
+    chunks = iter([recipients[i:i + batch_size] for i in range(0, len(recipients), batch_size)])
+    started = time.monotonic()
+
+    async def worker():
+        for chunk in chunks:
+            async with semaphore:
+                try:
+                    outcomes = await send_batch(chunk)
+                except Exception as e:
+                    outcomes = [{"success": False, "error": str(e)}] * len(chunk)
+            for recipient, outcome in zip(chunk, outcomes):
+                result.record(recipient, outcome)
+
+    await asyncio.gather(*(worker() for _ in range(max(1, workers))))
+
+    result.finish(started)
+    return result
+
+# Counters
+_background_tasks: List[asyncio.Task] = []
+
+COUNTER_FIELDS = ("subscribers", "active_subscribers", "messages", "broadcasts", "flows")
+
+def bump_counters(user_id: str, page_id: Optional[str], **deltas: int):
+    """Batched $inc of the user-wide and per-page counters behind /stats"""
+    write_batcher.increment("counters", {"key": f"user:{user_id}"}, deltas, {"user_id": user_id, "page_id": None})
+    if page_id:
+        write_batcher.increment("counters", {"key": f"page:{user_id}:{page_id}"}, deltas, {"user_id": user_id, "page_id": page_id})
+
+async def reconcile_counters(user_id: str, page_ids: Iterable[str] = ()):
+    """Recount a user's counters from the source collections, repairing any drift.
+
+    Recounted documents are marked `reconciled`; one created by a bump_counters
+    upsert alone only holds the deltas since then and is backfilled on first read.
+    """
+    # Apply queued bump_counters increments first, or they would land again on top of the recount
+    await write_batcher.flush()
+    page_ids = set(page_ids)
+    page_ids.update(await db.facebook_pages.distinct("page_id", {"user_id": user_id}))
+    page_ids.update(await db.counters.distinct("page_id", {"user_id": user_id, "page_id": {"$ne": None}}))
+    for collection in ("subscribers", "flows", "broadcasts"):
+        page_ids.update(await db[collection].distinct("page_id", {"user_id": user_id}))
+    
+    totals = dict.fromkeys(COUNTER_FIELDS, 0)
+    for page_id in page_ids:
+        query = {"user_id": user_id, "page_id": page_id}
+        counts = {
+            "subscribers": await db.subscribers.count_documents(query),
+            "active_subscribers": await db.subscribers.count_documents({**query, "subscribed": True}),
+            "messages": await db.messages.count_documents({"page_id": page_id}),
+            "broadcasts": await db.broadcasts.count_documents(query),
+            "flows": await db.flows.count_documents(query)
+        }
+        await db.counters.update_one(
+            {"key": f"page:{user_id}:{page_id}"},
+            {"$set": {**counts, "user_id": user_id, "page_id": page_id, "reconciled": True}},
+            upsert=True
+        )
+        for field, value in counts.items():
+            totals[field] += value
+    await db.counters.update_one(
+        {"key": f"user:{user_id}"},
+        {"$set": {**totals, "user_id": user_id, "page_id": None, "reconciled": True}},
+        upsert=True
+    )
+
+async def counter_reconcile_worker():
+    while True:
+        await asyncio.sleep(COUNTER_RECONCILE_SECONDS)
+        try:
+            async for user in db.users.find({}, {"_id": 0, "id": 1}):
+                await reconcile_counters(user["id"])
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            return {"success": False, "error": str(e)}
+            logging.error(f"Counter reconciliation failed: {e}")
+
+# Analytics rollups
+ANALYTICS_FIELDS = ("inbound", "outbound", "new_subscribers", "automation_hits")
+ANALYTICS_BUCKET_MS = {"hour": 3600 * 1000, "day": 86400 * 1000}
+ANALYTICS_MAX_BUCKETS = 2000
+
+def record_analytics(page_id: str, **deltas: int):
+    """Batched $inc of the page's current hourly and daily buckets (UTC, epoch-ms aligned)"""
+    deltas = {field: value for field, value in deltas.items() if value}
+    if not deltas:
+        return
+    now_ms = int(time.time() * 1000)
+    for granularity, size in ANALYTICS_BUCKET_MS.items():
+        write_batcher.increment(
+            "analytics",
+            {"page_id": page_id, "granularity": granularity, "bucket": now_ms - now_ms % size},
+            deltas
+        )
+
+# Delivery receipts
+def track_broadcast_message(broadcast_id: str, page_id: str, psid: str, sent_at: int, result: Dict):
+    """Remember which broadcast a sent message id belongs to, so its receipts can be counted"""
+    mid = result.get("success") and (result.get("data") or {}).get("message_id")
+    if not mid:
+        return
+    write_batcher.add("broadcast_messages", InsertOne({
+        "mid": mid,
+        "broadcast_id": broadcast_id,
+        "page_id": page_id,
+        "psid": psid,
+        "sent_at": sent_at,
+        "delivered": False,
+        "read": False,
+        "expires_at": datetime.now(timezone.utc) + timedelta(days=RECEIPT_TRACKING_DAYS)
+    }))
+
+class ReceiptAggregator:
+    """Buffers delivery and read receipts and flushes them as per-broadcast $inc updates, each message counted once"""
+
+    def __init__(self):
+        self.delivered: set = set()
+        self.read: Dict[tuple, int] = {}
+        self.wakeup = asyncio.Event()
+
+    def add_delivery(self, mids: List[str]):
+        self.delivered.update(mids)
+        self._check_size()
+
+    def add_read(self, page_id: str, psid: str, watermark: int):
+        # Reads carry no message ids: everything sent to the psid up to the watermark was read
+        key = (page_id, psid)
+        self.read[key] = max(watermark, self.read.get(key, 0))
+        self._check_size()
+
+    def _check_size(self):
+        if len(self.delivered) + len(self.read) >= RECEIPT_MAX_PENDING:
+            self.wakeup.set()
+
+    async def flush(self):
+        delivered, self.delivered = self.delivered, set()
+        read, self.read = self.read, {}
+        self.wakeup.clear()
+        deltas: Dict[str, Dict[str, int]] = {}
+
+        def count(broadcast_id: str, field: str, value: int):
+            if value:
+                totals = deltas.setdefault(broadcast_id, {})
+                totals[field] = totals.get(field, 0) + value
+
+        mids = list(delivered)
+        for start in range(0, len(mids), RECEIPT_MAX_PENDING):
+            chunk = mids[start:start + RECEIPT_MAX_PENDING]
+            by_broadcast: Dict[str, List[str]] = {}
+            async for message in db.broadcast_messages.find(
+                {"mid": {"$in": chunk}, "delivered": False}, {"_id": 0, "mid": 1, "broadcast_id": 1}
+            ):
+                by_broadcast.setdefault(message["broadcast_id"], []).append(message["mid"])
+            for broadcast_id, broadcast_mids in by_broadcast.items():
+                result = await db.broadcast_messages.update_many(
+                    {"mid": {"$in": broadcast_mids}, "delivered": False}, {"$set": {"delivered": True}}
+                )
+                count(broadcast_id, "delivered_count", result.modified_count)
+
+        by_page: Dict[str, Dict[str, int]] = {}
+        for (page_id, psid), watermark in read.items():
+            by_page.setdefault(page_id, {})[psid] = watermark
+        for page_id, watermarks in by_page.items():
+            by_broadcast = {}
+            async for message in db.broadcast_messages.find(
+                {"page_id": page_id, "psid": {"$in": list(watermarks)}, "read": False},
+                {"_id": 0, "mid": 1, "broadcast_id": 1, "psid": 1, "sent_at": 1}
+            ):
+                if message["sent_at"] <= watermarks[message["psid"]]:
+                    by_broadcast.setdefault(message["broadcast_id"], []).append(message["mid"])
+            for broadcast_id, broadcast_mids in by_broadcast.items():
+                # A read message was delivered even if its delivery receipt never arrived
+                result = await db.broadcast_messages.update_many(
+                    {"mid": {"$in": broadcast_mids}, "read": False, "delivered": False},
+                    {"$set": {"read": True, "delivered": True}}
+                )
+                count(broadcast_id, "delivered_count", result.modified_count)
+                count(broadcast_id, "read_count", result.modified_count)
+                result = await db.broadcast_messages.update_many(
+                    {"mid": {"$in": broadcast_mids}, "read": False}, {"$set": {"read": True}}
+                )
+                count(broadcast_id, "read_count", result.modified_count)
+
+        for broadcast_id, totals in deltas.items():
+            await db.broadcasts.update_one({"id": broadcast_id}, {"$inc": totals})
+
+receipt_aggregator = ReceiptAggregator()
+
+async def receipt_flush_worker():
+    try:
+        while True:
+            try:
+                await asyncio.wait_for(receipt_aggregator.wakeup.wait(), timeout=RECEIPT_FLUSH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await receipt_aggregator.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Receipt flush failed: {e}")
+    finally:
+        # Count what is still buffered on shutdown
+        await receipt_aggregator.flush()
 
 # Auth Routes
 @api_router.post("/auth/register")
@@ -250,8 +1314,12 @@ async def register(input: UserRegister):
     
     user = User(email=input.email, name=input.name)
     doc = user.model_dump()
-    doc["password"] = pwd_context.hash(input.password)
-    await db.users.insert_one(doc)
+    doc["password"] = await hash_password(input.password)
+    try:
+        await db.users.insert_one(doc)
+    except DuplicateKeyError:
+        # Lost a race with a concurrent sign-up for the same email
+        raise HTTPException(status_code=400, detail="Email already exists")
     
     token = create_token(user.id)
     return {"user": user, "token": token}
@@ -259,7 +1327,7 @@ async def register(input: UserRegister):
 @api_router.post("/auth/login")
 async def login(input: UserLogin):
     user_doc = await db.users.find_one({"email": input.email}, {"_id": 0})
-    if not user_doc or not pwd_context.verify(input.password, user_doc.get("password", "")):
+    if not user_doc or not await verify_password(input.password, user_doc.get("password", "")):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     user = User(**user_doc)
@@ -273,22 +1341,351 @@ async def get_me(current_user: User = Depends(get_current_user)):
 @api_router.get("/facebook/user-pages")
 async def get_user_facebook_pages(user_access_token: str, current_user: User = Depends(get_current_user)):
     """Get user's Facebook pages with access tokens"""
-    url = "https://graph.facebook.com/v20.0/me/accounts"
     params = {
         "access_token": user_access_token,
         "fields": "id,name,access_token,picture"
     }
     
-    async with httpx.AsyncClient() as client:
+    try:
+        response = await get_graph_client().get("/me/accounts", params=params)
+        if response.status_code == 200:
+            data = response.json()
+            return {"success": True, "pages": data.get("data", [])}
+        else:
+            return {"success": False, "error": response.text}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+# Keyword matching
+class KeywordMatcher:
+    """Aho-Corasick automaton over the lowercased keywords of a page's automations.
+
+    Matching is a single pass over the message text, independent of how many
+    keywords the page has. `match` returns the automations whose keyword occurs
+    in the text, each once, in the order they were given.
+    """
+
+    def __init__(self, automations: List[Dict]):
+        self.automations = []
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[int]] = [[]]
+        for automation in automations:
+            keyword = automation['trigger'].get('keyword', '').lower()
+            if keyword:
+                self._add(keyword, len(self.automations))
+                self.automations.append(automation)
+        self._link()
+
+    def _add(self, keyword: str, index: int):
+        node = 0
+        for char in keyword:
+            next_node = self.goto[node].get(char)
+            if next_node is None:
+                next_node = len(self.goto)
+                self.goto[node][char] = next_node
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            node = next_node
+        self.output[node].append(index)
+
+    def _link(self):
+        queue = list(self.goto[0].values())
+        for node in queue:
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def match(self, text: str) -> List[Dict]:
+        if not self.automations:
+            return []
+        found = set()
+        node = 0
+        for char in text.lower():
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            if self.output[node]:
+                found.update(self.output[node])
+        return [self.automations[index] for index in sorted(found)]
+
+class AutomationSnapshot:
+    """A page's active keyword automations joined with the compiled step graphs of their flows"""
+
+    def __init__(self, automations: List[Dict], flows: List[Dict]):
+        self.matcher = KeywordMatcher(automations)
+        self.flows: Dict[str, FlowGraph] = {}
+        for flow in flows:
+            graph = FlowGraph.from_flow(flow)
+            if graph is not None:
+                self.flows[flow["id"]] = graph
+
+    def replies_for(self, text: str) -> List["FlowGraph"]:
+        """Flows triggered by `text`, one per matching automation"""
+        return [
+            self.flows[automation["flow_id"]]
+            for automation in self.matcher.match(text)
+            if automation.get("flow_id") in self.flows
+        ]
+
+_automation_snapshots = TTLCache(maxsize=PAGE_CACHE_SIZE, ttl=AUTOMATION_CACHE_TTL)
+
+async def get_automation_snapshot(page_id: str) -> AutomationSnapshot:
+    """Snapshot of a page's automations and flows, rebuilt on change or after AUTOMATION_CACHE_TTL"""
+    snapshot = _automation_snapshots.get(page_id)
+    if snapshot is not None:
+        return snapshot
+    automations = await db.automations.find(
+        {"page_id": page_id, "is_active": True, "type": "keyword"},
+        {"_id": 0}
+    ).sort("created_at", 1).to_list(None)
+    flow_ids = list({automation["flow_id"] for automation in automations if automation.get("flow_id")})
+    flows = []
+    if flow_ids:
+        flows = await db.flows.find({"id": {"$in": flow_ids}}, FLOW_GRAPH_PROJECTION).to_list(None)
+    snapshot = AutomationSnapshot(automations, flows)
+    _automation_snapshots.set(page_id, snapshot)
+    return snapshot
+
+def invalidate_automation_snapshot(page_id: str):
+    _automation_snapshots.pop(page_id)
+
+# Page registry
+_page_cache = TTLCache(maxsize=PAGE_CACHE_SIZE, ttl=PAGE_CACHE_TTL)
+
+async def get_cached_page(page_id: str) -> Optional[Dict]:
+    """user_id and access_token of a Facebook page, cached by page_id.
+
+    Unknown pages are cached too, but only for PAGE_MISS_CACHE_TTL: a page just
+    connected through another process must start receiving webhooks quickly.
+    """
+    if page_id in _page_cache:
+        return _page_cache.get(page_id)
+    page = await db.facebook_pages.find_one(
+        {"page_id": page_id},
+        {"_id": 0, "page_id": 1, "user_id": 1, "access_token": 1}
+    )
+    _page_cache.set(page_id, page, ttl=None if page else PAGE_MISS_CACHE_TTL)
+    return page
+
+def invalidate_cached_page(page_id: str):
+    _page_cache.pop(page_id)
+
+# Flow runtime
+FLOW_GRAPH_PROJECTION = {"_id": 0, "id": 1, "page_id": 1, "version": 1, "is_active": 1, "steps": 1, "compiled_steps": 1}
+
+class FlowStepNode:
+    __slots__ = ("body", "next", "buttons", "titles")
+
+    def __init__(self, step: Dict):
+        self.body: Optional[bytes] = step["body"].encode() if step.get("body") is not None else None
+        self.next: Optional[str] = step.get("next")
+        # button id -> target step id, and the same keyed by title for typed answers
+        self.buttons: Dict[str, str] = {btn["id"]: btn["next"] for btn in step.get("buttons", [])}
+        self.titles: Dict[str, str] = {btn["title"].strip().lower(): btn["next"] for btn in step.get("buttons", [])}
+
+class FlowGraph:
+    """A flow's compiled steps indexed by step id, so every transition is a dict lookup"""
+
+    def __init__(self, flow: Dict, compiled: List[Dict]):
+        self.id = flow["id"]
+        self.page_id = flow.get("page_id")
+        self.version = flow.get("version", 1)
+        self.is_active = flow.get("is_active", True)
+        self.entry = compiled[0]["id"] if compiled else None
+        if compiled and all("next" not in step for step in compiled):
+            # Compiled before flows had a step graph: run the steps in order
+            for step, following in zip(compiled, compiled[1:] + [None]):
+                step["next"] = following["id"] if following else None
+        self.steps: Dict[str, FlowStepNode] = {step["id"]: FlowStepNode(step) for step in compiled}
+
+    @classmethod
+    def from_flow(cls, flow: Dict) -> Optional["FlowGraph"]:
+        compiled = flow.get("compiled_steps")
+        if compiled is None:
+            # Flow saved before steps were compiled on update; compile once here instead
+            try:
+                compiled = compile_flow_steps(flow.get("steps", []), flow["id"])
+            except HTTPException as e:
+                logging.warning(f"Skipping flow {flow['id']}: {e.detail}")
+                return None
+        return cls(flow, compiled)
+
+_flow_graphs = TTLCache(maxsize=PAGE_CACHE_SIZE, ttl=AUTOMATION_CACHE_TTL)
+
+async def get_flow_graph(flow_id: str) -> Optional[FlowGraph]:
+    """Compiled graph of a flow, cached by id (missing flows included)"""
+    if flow_id in _flow_graphs:
+        return _flow_graphs.get(flow_id)
+    flow = await db.flows.find_one({"id": flow_id}, FLOW_GRAPH_PROJECTION)
+    graph = FlowGraph.from_flow(flow) if flow else None
+    _flow_graphs.set(flow_id, graph)
+    return graph
+
+def invalidate_flow_graph(flow_id: str):
+    _flow_graphs.pop(flow_id)
+
+# (page_id, psid) -> the subscriber's flow session, or {} when it has none
+_flow_sessions = TTLCache(maxsize=SUBSCRIBER_CACHE_SIZE, ttl=3600)
+
+async def get_flow_session(page_id: str, psid: str) -> Dict:
+    key = (page_id, psid)
+    session = _flow_sessions.get(key)
+    if session is None:
+        session = await db.flow_sessions.find_one(
+            {"page_id": page_id, "psid": psid}, {"_id": 0, "flow_id": 1, "step_id": 1, "version": 1}
+        ) or {}
+        _flow_sessions.set(key, session)
+    return session
+
+def save_flow_session(page_id: str, psid: str, graph: FlowGraph, step_id: Optional[str]):
+    """Record where a subscriber waits in a flow (None: the flow ended); one batched write at most"""
+    key = (page_id, psid)
+    query = {"page_id": page_id, "psid": psid}
+    if step_id is None:
+        if _flow_sessions.get(key) == {}:
+            return
+        _flow_sessions.set(key, {})
+        write_batcher.add("flow_sessions", DeleteOne(query), key=key)
+        return
+    session = {"flow_id": graph.id, "step_id": step_id, "version": graph.version}
+    _flow_sessions.set(key, session)
+    write_batcher.add("flow_sessions", UpdateOne(
+        query, {"$set": {**session, "updated_at": datetime.now(timezone.utc).isoformat()}}, upsert=True
+    ), key=key)
+
+async def run_flow(page: Dict, psid: str, graph: FlowGraph, step_id: Optional[str]) -> int:
+    """Send steps from `step_id` along their `next` links until a step waits for a button or the flow ends.
+
+    Returns the number of messages sent.
+    """
+    dead_letter = {"user_id": page['user_id'], "page_id": page['page_id'], "source": "automation"}
+    sent = 0
+    # Bounded by the number of steps so a next_step_id cycle cannot loop forever
+    for _ in range(len(graph.steps)):
+        node = graph.steps.get(step_id) if step_id else None
+        if node is None:
+            break
+        if node.body is not None:
+            result = await send_flow_step(psid, node.body, page, dead_letter)
+            sent += bool(result and result['success'])
+        if node.buttons:
+            save_flow_session(page['page_id'], psid, graph, step_id)
+            return sent
+        step_id = node.next
+    save_flow_session(page['page_id'], psid, graph, None)
+    return sent
+
+async def advance_flow(page: Dict, psid: str, payload: Optional[str] = None, text: Optional[str] = None) -> Optional[int]:
+    """Follow a tapped flow button (its payload) or a typed answer matching a button of the waiting step.
+
+    Returns the number of messages sent, or None when the input does not move any flow.
+    """
+    if payload and payload.startswith(FLOW_PAYLOAD_PREFIX):
+        parts = payload[len(FLOW_PAYLOAD_PREFIX):].split(":", 2)
+        if len(parts) != 3:
+            return None
+        flow_id, step_id, button_id = parts
+        graph = await get_flow_graph(flow_id)
+        node = graph.steps.get(step_id) if graph else None
+        target = node.buttons.get(button_id) if node else None
+    elif text:
+        session = await get_flow_session(page['page_id'], psid)
+        if not session:
+            return None
+        graph = await get_flow_graph(session["flow_id"])
+        node = graph.steps.get(session["step_id"]) if graph else None
+        target = node.titles.get(text.strip().lower()) if node else None
+    else:
+        return None
+    if target is None or graph.page_id != page['page_id'] or not graph.is_active:
+        return None
+    return await run_flow(page, psid, graph, target)
+
+# Inbox push
+class InboxStream:
+    def __init__(self, queue_size: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.closed = False
+
+class InboxHub:
+    """In-process fan-out of inbox events to each user's open streams; a stream that falls behind is closed"""
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self._streams: Dict[str, set] = {}
+
+    def connect(self, user_id: str) -> InboxStream:
+        stream = InboxStream(self.queue_size)
+        self._streams.setdefault(user_id, set()).add(stream)
+        return stream
+
+    def disconnect(self, user_id: str, stream: InboxStream):
+        streams = self._streams.get(user_id)
+        if streams is not None:
+            streams.discard(stream)
+            if not streams:
+                del self._streams[user_id]
+
+    def publish(self, user_id: str, event: str, data: Dict):
+        streams = self._streams.get(user_id)
+        if not streams:
+            return
+        frame = f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        page_id = data.get("page_id")
+        for stream in list(streams):
+            try:
+                stream.queue.put_nowait((page_id, frame))
+            except asyncio.QueueFull:
+                # The client reconnects and catches up with GET /messages?since=
+                stream.closed = True
+                streams.discard(stream)
+                logging.warning(f"Inbox stream of user {user_id} fell behind; closing it")
+
+    @property
+    def connections(self) -> int:
+        return sum(len(streams) for streams in self._streams.values())
+
+inbox_hub = InboxHub(queue_size=INBOX_STREAM_QUEUE_SIZE)
+
+@api_router.get("/inbox/stream")
+async def stream_inbox(request: Request, token: Optional[str] = None, page_id: Optional[str] = None):
+    """Server-sent events with new messages and subscriber updates of the caller's pages.
+
+    EventSource cannot send headers, so the token may be passed as `?token=`.
+    """
+    if not token:
+        authorization = request.headers.get("Authorization", "")
+        token = authorization[7:] if authorization.startswith("Bearer ") else None
+    if not token:
+        raise HTTPException(status_code=401, detail="Missing token")
+    user = await authenticate_token(token)
+    stream = inbox_hub.connect(user.id)
+
+    async def events():
         try:
-            response = await client.get(url, params=params, timeout=10.0)
-            if response.status_code == 200:
-                data = response.json()
-                return {"success": True, "pages": data.get("data", [])}
-            else:
-                return {"success": False, "error": response.text}
-        except Exception as e:
-            return {"success": False, "error": str(e)}
+            yield "retry: 3000\n\n"
+            while not stream.closed:
+                try:
+                    event_page_id, frame = await asyncio.wait_for(stream.queue.get(), timeout=INBOX_STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if page_id is None or event_page_id == page_id:
+                    yield frame
+        finally:
+            inbox_hub.disconnect(user.id, stream)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 # Facebook Webhook
 @api_router.get("/webhook/facebook")
@@ -304,131 +1701,286 @@ async def verify_webhook(request: Request):
     else:
         raise HTTPException(status_code=403, detail="Verification failed")
 
+_webhook_queues: List[asyncio.Queue] = []
+_webhook_tasks: List[asyncio.Task] = []
+_webhook_metrics = {
+    "received": 0,
+    "processed": 0,
+    "failed": 0,
+    "rejected": 0,
+    "last_lag_seconds": 0.0,
+    "avg_lag_seconds": 0.0,
+    "max_lag_seconds": 0.0,
+}
+
 @api_router.post("/webhook/facebook")
 async def handle_webhook(request: Request):
-    """Handle incoming Facebook messages"""
+    """Verify and enqueue incoming Facebook events; webhook workers process them"""
+    raw_body = await request.body()
+    
+    # Verify signature
+    signature = request.headers.get('X-Hub-Signature-256', '')
+    if FACEBOOK_APP_SECRET:
+        expected_signature = 'sha256=' + hmac.new(
+            FACEBOOK_APP_SECRET.encode(),
+            raw_body,
+            hashlib.sha256
+        ).hexdigest()
+        
+        if not hmac.compare_digest(signature, expected_signature):
+            raise HTTPException(status_code=403, detail="Invalid signature")
+    
     try:
-        body = await request.json()
+        body = json.loads(raw_body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+    
+    if body.get('object') != 'page':
+        return {"status": "ok"}
+    
+    events = [
+        (entry.get('id'), messaging_event)
+        for entry in body.get('entry', [])
+        for messaging_event in entry.get('messaging', [])
+    ]
+    if not _webhook_queues:
+        # Workers not running (e.g. outside the app lifespan): process inline
+        for page_id, messaging_event in events:
+            await process_messaging_event(page_id, messaging_event)
+        return {"status": "ok"}
+    
+    # Events of one conversation always go to the same worker, which keeps them in order
+    shards: Dict[int, list] = {}
+    for page_id, messaging_event in events:
+        sender_id = messaging_event.get('sender', {}).get('id')
+        shards.setdefault(hash((page_id, sender_id)) % len(_webhook_queues), []).append((page_id, messaging_event))
+    
+    # Reject the whole delivery when it does not fit, so Facebook redelivers it intact
+    for index, shard in shards.items():
+        queue = _webhook_queues[index]
+        if queue.maxsize - queue.qsize() < len(shard):
+            _webhook_metrics["rejected"] += len(events)
+            raise HTTPException(status_code=503, detail="Webhook queue full")
+    enqueued_at = time.monotonic()
+    for index, shard in shards.items():
+        for page_id, messaging_event in shard:
+            _webhook_queues[index].put_nowait((page_id, messaging_event, enqueued_at))
+    _webhook_metrics["received"] += len(events)
+    
+    return {"status": "ok"}
+
+async def process_messaging_event(page_id: str, messaging_event: Dict):
+    """Handle one messaging event of a page webhook delivery"""
+    sender_id = messaging_event.get('sender', {}).get('id')
+    
+    # Get page from the registry cache
+    page = await get_cached_page(page_id)
+    if not page:
+        return
+    
+    # Handle message received
+    if messaging_event.get('message'):
+        message_text = messaging_event['message'].get('text', '')
         
-        # Verify signature
-        signature = request.headers.get('X-Hub-Signature-256', '')
-        if FACEBOOK_APP_SECRET:
-            expected_signature = 'sha256=' + hmac.new(
-                FACEBOOK_APP_SECRET.encode(),
-                (await request.body()),
-                hashlib.sha256
-            ).hexdigest()
-            
-            if signature != expected_signature:
-                raise HTTPException(status_code=403, detail="Invalid signature")
+        # Create or update subscriber
+        now = datetime.now(timezone.utc).isoformat()
+        subscriber_id, created = await touch_subscriber(page, sender_id, now)
+        if created:
+            bump_counters(page['user_id'], page_id, subscribers=1, active_subscribers=1, messages=1)
+        else:
+            bump_counters(page['user_id'], page_id, messages=1)
+        record_analytics(page_id, inbound=1, new_subscribers=int(created))
         
-        # Process webhook events
-        if body.get('object') == 'page':
-            for entry in body.get('entry', []):
-                page_id = entry.get('id')
-                
-                for messaging_event in entry.get('messaging', []):
-                    sender_id = messaging_event.get('sender', {}).get('id')
-                    recipient_id = messaging_event.get('recipient', {}).get('id')
-                    
-                    # Get page from DB
-                    page = await db.facebook_pages.find_one({"page_id": page_id}, {"_id": 0})
-                    if not page:
-                        continue
-                    
-                    # Handle message received
-                    if messaging_event.get('message'):
-                        message_text = messaging_event['message'].get('text', '')
-                        
-                        # Create or update subscriber
-                        subscriber = await db.subscribers.find_one(
-                            {"psid": sender_id, "page_id": page_id},
-                            {"_id": 0}
-                        )
-                        
-                        if not subscriber:
-                            # Create new subscriber
-                            subscriber_doc = {
-                                "id": str(uuid.uuid4()),
-                                "page_id": page_id,
-                                "user_id": page['user_id'],
-                                "psid": sender_id,
-                                "first_name": None,
-                                "last_name": None,
-                                "subscribed": True,
-                                "tags": [],
-                                "last_interaction": datetime.now(timezone.utc).isoformat(),
-                                "created_at": datetime.now(timezone.utc).isoformat()
-                            }
-                            await db.subscribers.insert_one(subscriber_doc)
-                            subscriber = subscriber_doc
-                        else:
-                            # Update last interaction
-                            await db.subscribers.update_one(
-                                {"psid": sender_id, "page_id": page_id},
-                                {"$set": {"last_interaction": datetime.now(timezone.utc).isoformat()}}
-                            )
-                        
-                        # Save message
-                        message_doc = {
-                            "id": str(uuid.uuid4()),
-                            "page_id": page_id,
-                            "subscriber_id": subscriber['id'],
-                            "sender": "subscriber",
-                            "message_type": "text",
-                            "content": {"text": message_text},
-                            "created_at": datetime.now(timezone.utc).isoformat()
-                        }
-                        await db.messages.insert_one(message_doc)
-                        
-                        # Check for automation triggers
-                        automations = await db.automations.find(
-                            {"page_id": page_id, "is_active": True},
-                            {"_id": 0}
-                        ).to_list(100)
-                        
-                        for automation in automations:
-                            if automation['type'] == 'keyword':
-                                keyword = automation['trigger'].get('keyword', '').lower()
-                                if keyword and keyword in message_text.lower():
-                                    # Trigger automation - send response
-                                    if automation.get('flow_id'):
-                                        # Send flow steps
-                                        flow = await db.flows.find_one({"id": automation['flow_id']}, {"_id": 0})
-                                        if flow and page.get('access_token'):
-                                            for step in flow.get('steps', []):
-                                                await send_flow_step(sender_id, step, page['access_token'])
-                    
-                    # Handle postback (button click)
-                    if messaging_event.get('postback'):
-                        payload = messaging_event['postback'].get('payload', '')
-                        # Handle button clicks
-                        logging.info(f"Postback received: {payload}")
+        # Save message
+        message_doc = {
+            "id": str(uuid.uuid4()),
+            "page_id": page_id,
+            "subscriber_id": subscriber_id,
+            "sender": "subscriber",
+            "message_type": "text",
+            "content": {"text": message_text},
+            "created_at": now
+        }
+        # Publish before queueing the insert: bulk_write adds an ObjectId _id to the document
+        inbox_hub.publish(page['user_id'], "subscriber", {
+            "id": subscriber_id,
+            "page_id": page_id,
+            "psid": sender_id,
+            "last_interaction": now,
+            "created": created
+        })
+        inbox_hub.publish(page['user_id'], "message", message_doc)
+        write_batcher.add("messages", InsertOne(message_doc))
         
-        return {"status": "ok"}
-    except Exception as e:
-        logging.error(f"Webhook error: {e}")
-        return {"status": "error", "message": str(e)}
+        # Continue a running flow (quick reply or typed button title), else check for automation triggers
+        if page.get('access_token'):
+            quick_reply = (messaging_event['message'].get('quick_reply') or {}).get('payload')
+            sent = await advance_flow(page, sender_id, payload=quick_reply, text=message_text)
+            if sent is not None:
+                record_analytics(page_id, outbound=sent)
+            else:
+                snapshot = await get_automation_snapshot(page_id)
+                replies = snapshot.replies_for(message_text)
+                sent = 0
+                for graph in replies:
+                    # Trigger automation - run the flow from its first step
+                    sent += await run_flow(page, sender_id, graph, graph.entry)
+                record_analytics(page_id, automation_hits=len(replies), outbound=sent)
+    
+    # Delivery and read receipts of messages the page sent
+    if messaging_event.get('delivery'):
+        receipt_aggregator.add_delivery(messaging_event['delivery'].get('mids') or [])
+    if messaging_event.get('read'):
+        receipt_aggregator.add_read(page_id, sender_id, messaging_event['read'].get('watermark') or 0)
+    
+    # Handle postback (button click)
+    if messaging_event.get('postback'):
+        payload = messaging_event['postback'].get('payload', '')
+        sent = await advance_flow(page, sender_id, payload=payload) if page.get('access_token') else None
+        if sent is None:
+            logging.info(f"Postback received: {payload}")
+        else:
+            record_analytics(page_id, outbound=sent)
 
-async def send_flow_step(recipient_id: str, step: Dict, access_token: str):
-    """Send a flow step to recipient"""
-    message_data = {}
+_subscriber_ids = TTLCache(maxsize=SUBSCRIBER_CACHE_SIZE, ttl=3600)
+
+async def touch_subscriber(page: Dict, psid: str, now: str):
+    """Return (subscriber id, created) for a page's psid, creating the subscriber on first contact.
+
+    Known subscribers only queue a batched last_interaction update; unknown
+    ones are upserted in one atomic round trip.
+    """
+    key = (page['page_id'], psid)
+    query = {"page_id": page['page_id'], "psid": psid}
+    subscriber_id = _subscriber_ids.get(key)
+    if subscriber_id:
+        write_batcher.add("subscribers", UpdateOne(query, {"$set": {"last_interaction": now}}), key=key)
+        return subscriber_id, False
     
-    if step['type'] == 'message':
-        message_data = {"text": step['content'].get('text', '')}
-        if step.get('buttons'):
+    new_id = str(uuid.uuid4())
+    update = {
+        "$set": {"last_interaction": now},
+        "$setOnInsert": {
+            "id": new_id,
+            "user_id": page['user_id'],
+            "first_name": None,
+            "last_name": None,
+            "subscribed": True,
+            "tags": [],
+            "created_at": now
+        }
+    }
+    try:
+        existing = await db.subscribers.find_one_and_update(
+            query, update, projection={"_id": 0, "id": 1}, upsert=True, return_document=ReturnDocument.BEFORE
+        )
+    except DuplicateKeyError:
+        # Another process inserted it concurrently; the unique index made our upsert lose
+        existing = await db.subscribers.find_one_and_update(
+            query, {"$set": {"last_interaction": now}}, projection={"_id": 0, "id": 1}
+        )
+    subscriber_id = existing["id"] if existing else new_id
+    _subscriber_ids.set(key, subscriber_id)
+    return subscriber_id, existing is None
+
+async def webhook_worker(queue: asyncio.Queue):
+    while True:
+        page_id, messaging_event, enqueued_at = await queue.get()
+        lag = time.monotonic() - enqueued_at
+        _webhook_metrics["last_lag_seconds"] = lag
+        _webhook_metrics["avg_lag_seconds"] = 0.9 * _webhook_metrics["avg_lag_seconds"] + 0.1 * lag
+        _webhook_metrics["max_lag_seconds"] = max(_webhook_metrics["max_lag_seconds"], lag)
+        try:
+            await process_messaging_event(page_id, messaging_event)
+            _webhook_metrics["processed"] += 1
+        except Exception as e:
+            _webhook_metrics["failed"] += 1
+            logging.error(f"Webhook error: {e}")
+        finally:
+            queue.task_done()
+
+@api_router.get("/webhook/facebook/stats")
+async def get_webhook_stats(current_user: User = Depends(get_current_user)):
+    """Webhook queue depth and processing lag"""
+    return {
+        "queue_depth": sum(queue.qsize() for queue in _webhook_queues),
+        "queue_size": sum(queue.maxsize for queue in _webhook_queues),
+        "workers": len(_webhook_tasks),
+        **_webhook_metrics
+    }
+
+@api_router.get("/graph/circuits")
+async def get_graph_circuits(current_user: User = Depends(get_current_user)):
+    """Circuit breaker and send rate state of the Graph API and of the caller's pages"""
+    pages = await db.facebook_pages.find(
+        {"user_id": current_user.id}, {"_id": 0, "page_id": 1, "page_name": 1}
+    ).to_list(1000)
+    states = []
+    for page in pages:
+        circuit = _page_circuits.get(page["page_id"]) or CircuitBreaker()
+        limiter = _send_rate_limiters.get(page["page_id"])
+        states.append({
+            "page_id": page["page_id"],
+            "page_name": page.get("page_name"),
+            **circuit.status(),
+            "send_rate": round(limiter.rate, 1) if limiter else GRAPH_SEND_RATE
+        })
+    return {"global": global_circuit.status(), "pages": states}
+
+FLOW_PAYLOAD_PREFIX = "FLOW:"
+
+def flow_button_payload(flow_id: str, step_id: str, button_id: str) -> str:
+    """Quick reply / postback payload naming the flow button that was tapped"""
+    return f"{FLOW_PAYLOAD_PREFIX}{flow_id}:{step_id}:{button_id}"
+
+def compile_flow_step(step: Dict, flow_id: str = "", step_ids: Iterable[str] = ()) -> Optional[bytes]:
+    """Validate a flow step and serialize it into the Messenger `message` body sent when it runs.
+
+    Buttons with a `next_step_id` become quick replies / postback buttons whose
+    payload leads the flow runtime to that step. Steps that send nothing
+    (e.g. `delay`) compile to None and are passed over when the flow runs.
+    """
+    content = step.get('content') or {}
+    buttons = step.get('buttons') or []
+    step_id = step.get('id')
+    for btn in buttons:
+        if btn.get('next_step_id') and btn['next_step_id'] not in step_ids:
+            raise HTTPException(status_code=400, detail=f"Step {step_id}: button leads to unknown step {btn['next_step_id']}")
+    if step.get('next_step_id') and step['next_step_id'] not in step_ids:
+        raise HTTPException(status_code=400, detail=f"Step {step_id}: next step {step['next_step_id']} does not exist")
+
+    def payload(index: int, btn: Dict) -> str:
+        return flow_button_payload(flow_id, step_id, btn.get('id') or str(index))
+
+    if step.get('type') == 'message':
+        if not content.get('text'):
+            raise HTTPException(status_code=400, detail=f"Step {step_id}: message text is required")
+        message_data = {"text": content['text']}
+        if buttons:
+            if any(not btn.get('title') for btn in buttons):
+                raise HTTPException(status_code=400, detail=f"Step {step_id}: every button needs a title")
             message_data['quick_replies'] = [
-                {"content_type": "text", "title": btn['title'], "payload": btn.get('url', '')}
-                for btn in step['buttons'][:11]
+                {
+                    "content_type": "text",
+                    "title": btn['title'],
+                    "payload": payload(index, btn) if btn.get('next_step_id') else btn.get('url', '')
+                }
+                for index, btn in enumerate(buttons[:11])
             ]
-    elif step['type'] == 'card':
+    elif step.get('type') == 'card':
+        if not content.get('title'):
+            raise HTTPException(status_code=400, detail=f"Step {step_id}: card title is required")
+        if any(not btn.get('title') or not (btn.get('url') or btn.get('next_step_id')) for btn in buttons):
+            raise HTTPException(status_code=400, detail=f"Step {step_id}: card buttons need a title and a url or next step")
         elements = [{
-            "title": step['content'].get('title', ''),
-            "subtitle": step['content'].get('subtitle', ''),
-            "image_url": step['content'].get('image_url', ''),
+            "title": content['title'],
+            "subtitle": content.get('subtitle', ''),
+            "image_url": content.get('image_url', ''),
             "buttons": [
+                {"type": "postback", "title": btn['title'], "payload": payload(index, btn)}
+                if btn.get('next_step_id') else
                 {"type": "web_url", "url": btn['url'], "title": btn['title']}
-                for btn in step.get('buttons', [])[:3]
+                for index, btn in enumerate(buttons[:3])
             ]
         }]
         message_data = {
@@ -440,9 +1992,44 @@ async def send_flow_step(recipient_id: str, step: Dict, access_token: str):
                 }
             }
         }
-    
-    if message_data:
-        await send_facebook_message(recipient_id, message_data, access_token)
+    else:
+        return None
+    return encode_message(message_data)
+
+def compile_flow_steps(steps: List[Dict], flow_id: str = "") -> List[Dict]:
+    """Compiled step graph of a flow as stored on the flow document, entry step first.
+
+    Each step keeps its body, the step that follows it and its branching
+    buttons. Flows that never set `next_step_id` run their steps in order.
+    """
+    step_ids = [step.get('id') for step in steps]
+    linear = not any(
+        step.get('next_step_id') or any(btn.get('next_step_id') for btn in step.get('buttons') or [])
+        for step in steps
+    )
+    compiled = []
+    for index, step in enumerate(steps):
+        if linear:
+            next_step_id = step_ids[index + 1] if index + 1 < len(steps) else None
+        else:
+            next_step_id = step.get('next_step_id')
+        limit = 11 if step.get('type') == 'message' else 3
+        body = compile_flow_step(step, flow_id, step_ids)
+        compiled.append({
+            "id": step.get('id'),
+            "body": body.decode() if body is not None else None,
+            "next": next_step_id,
+            "buttons": [
+                {"id": btn.get('id') or str(i), "title": btn.get('title', ''), "next": btn['next_step_id']}
+                for i, btn in enumerate((step.get('buttons') or [])[:limit])
+                if btn.get('next_step_id')
+            ]
+        })
+    return compiled
+
+async def send_flow_step(recipient_id: str, step_body: bytes, page: Dict, dead_letter: Optional[Dict] = None):
+    """Send a precompiled flow step to recipient"""
+    return await send_message_body(recipient_id, step_body, page, dead_letter)
 
 # Facebook Pages
 @api_router.post("/pages", response_model=FacebookPage)
@@ -450,6 +2037,7 @@ async def create_page(input: FacebookPageCreate, current_user: User = Depends(ge
     page = FacebookPage(user_id=current_user.id, **input.model_dump())
     doc = page.model_dump()
     await db.facebook_pages.insert_one(doc)
+    invalidate_cached_page(page.page_id)
     return page
 
 @api_router.get("/pages", response_model=List[FacebookPage])
@@ -459,20 +2047,26 @@ async def get_pages(current_user: User = Depends(get_current_user)):
 
 @api_router.delete("/pages/{page_id}")
 async def delete_page(page_id: str, current_user: User = Depends(get_current_user)):
-    result = await db.facebook_pages.delete_one({"id": page_id, "user_id": current_user.id})
-    if result.deleted_count == 0:
+    page = await db.facebook_pages.find_one_and_delete(
+        {"id": page_id, "user_id": current_user.id},
+        projection={"_id": 0, "page_id": 1}
+    )
+    if not page:
         raise HTTPException(status_code=404, detail="Page not found")
+    invalidate_cached_page(page["page_id"])
     return {"success": True}
 
 @api_router.patch("/pages/{page_id}")
 async def update_page_token(page_id: str, access_token: str, current_user: User = Depends(get_current_user)):
     """Update page access token"""
-    result = await db.facebook_pages.update_one(
+    page = await db.facebook_pages.find_one_and_update(
         {"id": page_id, "user_id": current_user.id},
-        {"$set": {"access_token": access_token}}
+        {"$set": {"access_token": access_token}},
+        projection={"_id": 0, "page_id": 1}
     )
-    if result.matched_count == 0:
+    if not page:
         raise HTTPException(status_code=404, detail="Page not found")
+    invalidate_cached_page(page["page_id"])
     return {"success": True}
 
 # Subscribers
@@ -480,16 +2074,67 @@ async def update_page_token(page_id: str, access_token: str, current_user: User
 async def create_subscriber(input: SubscriberCreate, current_user: User = Depends(get_current_user)):
     subscriber = Subscriber(user_id=current_user.id, **input.model_dump())
     doc = subscriber.model_dump()
-    await db.subscribers.insert_one(doc)
+    try:
+        await db.subscribers.insert_one(doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Subscriber already exists for this page")
+    bump_counters(current_user.id, subscriber.page_id, subscribers=1, active_subscribers=int(subscriber.subscribed))
+    record_analytics(subscriber.page_id, new_subscribers=1)
     return subscriber
 
-@api_router.get("/subscribers", response_model=List[Subscriber])
-async def get_subscribers(page_id: Optional[str] = None, current_user: User = Depends(get_current_user)):
+def encode_cursor(*values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(token: str, size: int) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+@api_router.get("/subscribers")
+async def get_subscribers(
+    page_id: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    current_user: User = Depends(get_current_user)
+):
+    """List subscribers ordered by (created_at, id).
+
+    `json` returns one page of `limit` items (default 100) and a `next_after`
+    cursor; `ndjson` streams every matching subscriber, one per line, unless
+    `limit` is given.
+    """
     query = {"user_id": current_user.id}
     if page_id:
         query["page_id"] = page_id
-    subscribers = await db.subscribers.find(query, {"_id": 0}).to_list(10000)
-    return subscribers
+    if after:
+        created_at, last_id = decode_cursor(after, 2)
+        query["$or"] = [
+            {"created_at": {"$gt": created_at}},
+            {"created_at": created_at, "id": {"$gt": last_id}}
+        ]
+    cursor = db.subscribers.find(query, {"_id": 0}).sort([("created_at", 1), ("id", 1)])
+
+    if format == "ndjson":
+        if limit:
+            cursor = cursor.limit(limit)
+
+        async def stream():
+            async for subscriber in cursor.batch_size(1000):
+                yield json.dumps(subscriber, ensure_ascii=False) + "\n"
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    limit = limit or 100
+    subscribers = await cursor.limit(limit).to_list(limit)
+    next_after = None
+    if len(subscribers) == limit:
+        next_after = encode_cursor(subscribers[-1]["created_at"], subscribers[-1]["id"])
+    return JSONResponse({"items": subscribers, "next_after": next_after})
 
 @api_router.get("/subscribers/{subscriber_id}", response_model=Subscriber)
 async def get_subscriber(subscriber_id: str, current_user: User = Depends(get_current_user)):
@@ -513,7 +2158,9 @@ async def update_subscriber(subscriber_id: str, tags: List[str], current_user: U
 async def create_flow(input: FlowCreate, current_user: User = Depends(get_current_user)):
     flow = Flow(user_id=current_user.id, **input.model_dump())
     doc = flow.model_dump()
+    doc["compiled_steps"] = []
     await db.flows.insert_one(doc)
+    bump_counters(current_user.id, flow.page_id, flows=1)
     return flow
 
 @api_router.get("/flows", response_model=List[Flow])
@@ -521,12 +2168,12 @@ async def get_flows(page_id: Optional[str] = None, current_user: User = Depends(
     query = {"user_id": current_user.id}
     if page_id:
         query["page_id"] = page_id
-    flows = await db.flows.find(query, {"_id": 0}).to_list(1000)
+    flows = await db.flows.find(query, {"_id": 0, "compiled_steps": 0}).to_list(1000)
     return flows
 
 @api_router.get("/flows/{flow_id}", response_model=Flow)
 async def get_flow(flow_id: str, current_user: User = Depends(get_current_user)):
-    flow = await db.flows.find_one({"id": flow_id, "user_id": current_user.id}, {"_id": 0})
+    flow = await db.flows.find_one({"id": flow_id, "user_id": current_user.id}, {"_id": 0, "compiled_steps": 0})
     if not flow:
         raise HTTPException(status_code=404, detail="Flow not found")
     return Flow(**flow)
@@ -535,22 +2182,34 @@ async def get_flow(flow_id: str, current_user: User = Depends(get_current_user))
 async def update_flow(flow_id: str, input: FlowUpdate, current_user: User = Depends(get_current_user)):
     update_data = {k: v for k, v in input.model_dump().items() if v is not None}
     update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
+    if "steps" in update_data:
+        # Validate and serialize once here so triggering the flow only sends stored bytes
+        update_data["compiled_steps"] = compile_flow_steps(update_data["steps"], flow_id)
     
-    result = await db.flows.update_one(
+    flow = await db.flows.find_one_and_update(
         {"id": flow_id, "user_id": current_user.id},
-        {"$set": update_data}
+        {"$set": update_data, "$inc": {"version": 1}},
+        projection={"_id": 0, "compiled_steps": 0},
+        return_document=ReturnDocument.AFTER
     )
-    if result.matched_count == 0:
+    if not flow:
         raise HTTPException(status_code=404, detail="Flow not found")
     
-    flow = await db.flows.find_one({"id": flow_id}, {"_id": 0})
+    invalidate_automation_snapshot(flow["page_id"])
+    invalidate_flow_graph(flow_id)
     return Flow(**flow)
 
 @api_router.delete("/flows/{flow_id}")
 async def delete_flow(flow_id: str, current_user: User = Depends(get_current_user)):
-    result = await db.flows.delete_one({"id": flow_id, "user_id": current_user.id})
-    if result.deleted_count == 0:
+    flow = await db.flows.find_one_and_delete(
+        {"id": flow_id, "user_id": current_user.id},
+        projection={"_id": 0, "page_id": 1}
+    )
+    if not flow:
         raise HTTPException(status_code=404, detail="Flow not found")
+    invalidate_automation_snapshot(flow["page_id"])
+    invalidate_flow_graph(flow_id)
+    bump_counters(current_user.id, flow["page_id"], flows=-1)
     return {"success": True}
 
 # Broadcasts
@@ -559,6 +2218,7 @@ async def create_broadcast(input: BroadcastCreate, current_user: User = Depends(
     broadcast = Broadcast(user_id=current_user.id, status="draft", **input.model_dump())
     doc = broadcast.model_dump()
     await db.broadcasts.insert_one(doc)
+    bump_counters(current_user.id, broadcast.page_id, broadcasts=1)
     return broadcast
 
 @api_router.get("/broadcasts", response_model=List[Broadcast])
@@ -576,119 +2236,501 @@ async def get_broadcast(broadcast_id: str, current_user: User = Depends(get_curr
         raise HTTPException(status_code=404, detail="Broadcast not found")
     return Broadcast(**broadcast)
 
+def build_broadcast_messages(message_content: Dict):
+    """Build the Messenger payloads for a broadcast: the main message and the optional clickable image"""
+    if message_content.get('cards') and len(message_content['cards']) > 0:
+        # Send cards
+        elements = []
+        for card in message_content['cards'][:10]:
+            element = {
+                "title": card.get('title', ''),
+                "subtitle": card.get('subtitle', ''),
+                "image_url": card.get('image_url', ''),
+                "buttons": []
+            }
+            for btn in card.get('buttons', [])[:3]:
+                element['buttons'].append({
+                    "type": "web_url",
+                    "url": btn['url'],
+                    "title": btn['title']
+                })
+            elements.append(element)
+        
+        msg_data = {
+            "attachment": {
+                "type": "template",
+                "payload": {
+                    "template_type": "generic",
+                    "elements": elements
+                }
+            }
+        }
+    else:
+        # Send text message
+        msg_data = {"text": message_content.get('text', '')}
+        if message_content.get('buttons'):
+            msg_data['quick_replies'] = [
+                {"content_type": "text", "title": btn['title'], "payload": btn.get('url', '')}
+                for btn in message_content['buttons'][:11]
+            ]
+    
+    img_msg = None
+    if message_content.get('clickable_image') and message_content['clickable_image'].get('url'):
+        img_msg = {
+            "attachment": {
+                "type": "template",
+                "payload": {
+                    "template_type": "button",
+                    "text": message_content.get('text', 'تحقق من هذا!'),
+                    "buttons": [{
+                        "type": "web_url",
+                        "url": message_content['clickable_image'].get('click_url', '#'),
+                        "title": "اضغط هنا"
+                    }]
+                }
+            }
+        }
+    return msg_data, img_msg
+
+# Subscriber fields a broadcast message may reference as {first_name}-style placeholders
+PLACEHOLDER_FIELDS = ("first_name", "last_name")
+
+class MessageTemplate:
+    """A Messenger `message` object serialized once, with `{field}` placeholders filled in per recipient.
+
+    The serialized body is split around the placeholders up front, so rendering
+    for a subscriber only joins byte chunks with that subscriber's escaped values.
+    """
+
+    PLACEHOLDER = re.compile(rb'\{(' + b'|'.join(f.encode() for f in PLACEHOLDER_FIELDS) + rb')\}')
+
+    def __init__(self, message_data: Dict):
+        self.body = encode_message(message_data)
+        # re.split with one group alternates literal chunks and field names
+        self.parts: List[bytes] = self.PLACEHOLDER.split(self.body)
+        self.fields = sorted({part.decode() for part in self.parts[1::2]})
+
+    def render(self, subscriber: Dict) -> bytes:
+        if not self.fields:
+            return self.body
+        chunks = self.parts[:]
+        for i in range(1, len(chunks), 2):
+            value = subscriber.get(chunks[i].decode()) or ""
+            # Escaped as the inside of a JSON string, which is where the placeholder sits
+            chunks[i] = json.dumps(value, ensure_ascii=False)[1:-1].encode()
+        return b"".join(chunks)
+
+# Broadcast jobs
+_broadcast_job_wakeup: Optional[asyncio.Event] = None
+_broadcast_job_tasks: List[asyncio.Task] = []
+
+def broadcast_audience_query(broadcast: Dict) -> Dict:
+    query = {"page_id": broadcast["page_id"], "subscribed": True}
+    if broadcast["target_audience"] == "tags" and broadcast["target_tags"]:
+        query["tags"] = {"$in": broadcast["target_tags"]}
+    return query
+
+async def iter_audience_batches(
+    query: Dict,
+    after_psid: Optional[str] = None,
+    fields: Iterable[str] = (),
+    batch_size: int = BROADCAST_BATCH_SIZE,
+):
+    """Stream the audience as psid-ordered batches from a single cursor.
+
+    Only `psid` and the requested personalization `fields` are projected and at
+    most one batch is held in memory, so the audience size is unbounded.
+    """
+    if after_psid is not None:
+        query = {**query, "psid": {"$gt": after_psid}}
+    projection = {"_id": 0, "psid": 1, **{field: 1 for field in fields}}
+    cursor = db.subscribers.find(query, projection).sort("psid", 1).batch_size(batch_size)
+    batch = []
+    async for subscriber in cursor:
+        batch.append(subscriber)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def claim_broadcast_job() -> Optional[Dict]:
+    """Lease the oldest runnable job; jobs whose lease expired (crashed worker) are picked up again.
+
+    Every claim gets its own lease token in `lease_owner`, so two coroutines of
+    one process never both hold the same job.
+    """
+    now = time.time()
+    return await db.broadcast_jobs.find_one_and_update(
+        {"status": {"$in": ["queued", "sending"]}, "lease_expires_at": {"$lt": now}},
+        {"$set": {
+            "status": "sending",
+            "lease_owner": f"{WORKER_ID}-{uuid.uuid4().hex}",
+            "lease_expires_at": now + BROADCAST_JOB_LEASE_SECONDS,
+            "updated_at": datetime.now(timezone.utc).isoformat()
+        }},
+        projection={"_id": 0},
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+async def checkpoint_broadcast_job(job: Dict, update: Dict) -> bool:
+    """Persist job progress and renew the lease; False means another worker took the job over"""
+    update.setdefault("$set", {}).update({
+        "lease_expires_at": time.time() + BROADCAST_JOB_LEASE_SECONDS,
+        "updated_at": datetime.now(timezone.utc).isoformat()
+    })
+    result = await db.broadcast_jobs.update_one({"id": job["id"], "lease_owner": job["lease_owner"]}, update)
+    return result.matched_count == 1
+
+async def run_under_lease(job: Dict, awaitable: Awaitable) -> tuple:
+    """Await `awaitable` while renewing the job lease; returns (result, lease still held).
+
+    A batch can outlast BROADCAST_JOB_LEASE_SECONDS when sends are throttled;
+    if the lease is lost meanwhile the send is cancelled, since its recipients
+    are already recorded as `pending_batch` for whoever took the job over.
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=BROADCAST_JOB_LEASE_SECONDS / 3)
+            if done:
+                return task.result(), True
+            if not await checkpoint_broadcast_job(job, {}):
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                return None, False
+    except BaseException:
+        # Worker cancelled (shutdown) or checkpoint failed: never leave the send running on its own
+        task.cancel()
+        raise
+
+async def finish_broadcast_job(job: Dict, status: str, error: Optional[str] = None):
+    now = datetime.now(timezone.utc).isoformat()
+    result = await db.broadcast_jobs.update_one(
+        {"id": job["id"], "lease_owner": job["lease_owner"]},
+        {"$set": {"status": status, "error": error, "finished_at": now, "updated_at": now, "lease_owner": None}}
+    )
+    if result.matched_count == 0:
+        # Lease lost: the job and its broadcast belong to whichever worker holds it now
+        return
+    job = await db.broadcast_jobs.find_one({"id": job["id"]}, {"_id": 0})
+    update = {
+        "status": status,
+        "total_recipients": job["total_recipients"],
+        "sent_count": job["sent_count"]
+    }
+    if status == "sent":
+        update["sent_at"] = now
+    await db.broadcasts.update_one({"id": job["broadcast_id"]}, {"$set": update})
+    logging.info(
+        f"Broadcast {job['broadcast_id']} {status}: {job['sent_count']}/{job['total_recipients']} sent, "
+        f"{job['skipped_count']} skipped in {job['duration_seconds']:.2f}s ({job.get('messages_per_second', 0)} msg/s)"
+    )
+
+async def settle_pending_batch(broadcast_id: str, psids: List[str]) -> tuple:
+    """(sent, failed, unknown psids) of an interrupted batch, from its tracked messages and dead letters"""
+    sent = set(await db.broadcast_messages.distinct("psid", {"broadcast_id": broadcast_id, "psid": {"$in": psids}}))
+    failed = set(await db.dead_letters.distinct(
+        "recipient_id", {"broadcast_id": broadcast_id, "source": "broadcast", "recipient_id": {"$in": psids}}
+    )) - sent
+    return len(sent), len(failed), [psid for psid in psids if psid not in sent and psid not in failed]
+
+async def dead_letter_unknown_recipients(broadcast: Dict, psids: List[str], templates: List[MessageTemplate], fields: Iterable[str], dead_letter: Dict):
+    """Dead-letter recipients whose delivery is unknown, so they can be re-driven deliberately"""
+    if not psids:
+        return
+    result = send_failure("Delivery unknown: broadcast job was interrupted mid-batch", {}, False, 0)
+    projection = {"_id": 0, "psid": 1, **{field: 1 for field in fields}}
+    async for subscriber in db.subscribers.find({"page_id": broadcast["page_id"], "psid": {"$in": psids}}, projection):
+        store_dead_letter(subscriber["psid"], templates[0].render(subscriber), result, dead_letter)
+        for template in templates[1:]:
+            store_dead_letter(subscriber["psid"], template.render(subscriber), result, {**dead_letter, "source": "broadcast_image"})
+    # Written before the checkpoint clears pending_batch, or a crash in between would lose them
+    await write_batcher.flush()
+
+async def run_broadcast_job(job: Dict):
+    """Send a broadcast in checkpointed batches of recipients ordered by psid.
+
+    Before a batch is sent its psids are stored as `pending_batch`; after it is
+    sent the checkpoint moves `last_psid` past it. A job resumed with a pending
+    batch settles it from its records instead of sending it again, so nobody
+    receives the broadcast twice.
+    """
+    broadcast = await db.broadcasts.find_one({"id": job["broadcast_id"]}, {"_id": 0})
+    page = await db.facebook_pages.find_one({"page_id": job["page_id"]}, {"_id": 0})
+    if not broadcast:
+        await finish_broadcast_job(job, "failed", "Broadcast not found")
+        return
+    if not page or not page.get('access_token'):
+        await finish_broadcast_job(job, "failed", "Page not connected or missing access token")
+        return
+    await db.broadcasts.update_one({"id": broadcast["id"]}, {"$set": {"status": "sending"}})
+
+    query = broadcast_audience_query(broadcast)
+    msg_data, img_msg = build_broadcast_messages(broadcast['message'])
+    templates = [MessageTemplate(msg_data)] + ([MessageTemplate(img_msg)] if img_msg else [])
+    fields = {field for template in templates for field in template.fields}
+    semaphore = get_page_send_semaphore(page)
+    limit = page.get('send_concurrency') or BROADCAST_CONCURRENCY
+    # Enough recipients per checkpoint for `limit` Graph batch requests to be in flight at once
+    batch_size = max(BROADCAST_BATCH_SIZE, limit * GRAPH_BATCH_SIZE)
+
+    dead_letter = {"user_id": job["user_id"], "page_id": page["page_id"], "broadcast_id": broadcast["id"], "source": "broadcast"}
+
+    last_psid = job.get("last_psid")
+    if job.get("pending_batch"):
+        # Interrupted mid-batch: do not send again, settle the batch from what was recorded
+        pending = job["pending_batch"]
+        last_psid = max(pending)
+        sent, failed, unknown = await settle_pending_batch(broadcast["id"], pending)
+        logging.warning(
+            f"Broadcast job {job['id']} resumed with {len(pending)} in-flight recipients: "
+            f"{sent} sent, {failed} failed, {len(unknown)} unknown"
+        )
+        await dead_letter_unknown_recipients(broadcast, unknown, templates, fields, dead_letter)
+        record_analytics(page["page_id"], outbound=sent)
+        if not await checkpoint_broadcast_job(job, {
+            "$set": {"last_psid": last_psid, "pending_batch": None},
+            "$inc": {
+                "total_recipients": len(pending),
+                "sent_count": sent,
+                "failed_count": failed,
+                "skipped_count": len(unknown)
+            }
+        }):
+            return
+
+    async def send_to_subscribers(subscribers: List[Dict]) -> List[Dict]:
+        # Taken before sending so it never runs ahead of the message timestamps read watermarks compare to
+        sent_at = int(time.time() * 1000)
+        results = await send_message_batch(
+            [(subscriber['psid'], templates[0].render(subscriber)) for subscriber in subscribers],
+            page, dead_letter
+        )
+        for subscriber, result in zip(subscribers, results):
+            track_broadcast_message(broadcast["id"], page["page_id"], subscriber['psid'], sent_at, result)
+        # Send clickable image if exists, after the main message of the same recipients
+        for template in templates[1:]:
+            await send_message_batch(
+                [(subscriber['psid'], template.render(subscriber)) for subscriber in subscribers],
+                page, {**dead_letter, "source": "broadcast_image"}
+            )
+        return results
+
+    sent_count, duration_seconds = job.get("sent_count", 0), job.get("duration_seconds", 0.0)
+    async for batch in iter_audience_batches(query, last_psid, fields, batch_size):
+        # Wait out an open breaker instead of failing the rest of the audience into dead letters
+        while (wait := send_circuit_retry_in(page['page_id'])) > 0:
+            if not await checkpoint_broadcast_job(job, {}):
+                return
+            await asyncio.sleep(min(wait, BROADCAST_JOB_LEASE_SECONDS / 2))
+        psids = [subscriber['psid'] for subscriber in batch]
+        if not await checkpoint_broadcast_job(job, {"$set": {"pending_batch": psids}}):
+            return
+        outcome, held = await run_under_lease(job, fan_out_batches(batch, send_to_subscribers, semaphore, workers=limit))
+        if not held:
+            return
+        record_analytics(page["page_id"], outbound=outcome.sent_count)
+        last_psid = psids[-1]
+        sent_count += outcome.sent_count
+        duration_seconds += outcome.duration_seconds
+        if not await checkpoint_broadcast_job(job, {
+            "$set": {
+                "last_psid": last_psid,
+                "pending_batch": None,
+                "messages_per_second": round(sent_count / duration_seconds, 2) if duration_seconds > 0 else 0.0
+            },
+            "$inc": {
+                "batches_done": 1,
+                "total_recipients": outcome.total_recipients,
+                "sent_count": outcome.sent_count,
+                "failed_count": outcome.failed_count,
+                "duration_seconds": outcome.duration_seconds
+            },
+            "$push": {"failures": {"$each": outcome.failures, "$slice": -100}}
+        }):
+            return
+
+    await finish_broadcast_job(job, "sent")
+
+async def broadcast_job_worker():
+    while True:
+        try:
+            job = await claim_broadcast_job()
+            if job:
+                try:
+                    await run_broadcast_job(job)
+                except Exception as e:
+                    logging.error(f"Broadcast job {job['id']} failed: {e}")
+                    await finish_broadcast_job(job, "failed", str(e))
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Broadcast job worker error: {e}")
+        _broadcast_job_wakeup.clear()
+        try:
+            await asyncio.wait_for(_broadcast_job_wakeup.wait(), timeout=BROADCAST_JOB_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
 @api_router.post("/broadcasts/{broadcast_id}/send")
 async def send_broadcast(broadcast_id: str, current_user: User = Depends(get_current_user)):
     broadcast = await db.broadcasts.find_one({"id": broadcast_id, "user_id": current_user.id}, {"_id": 0})
     if not broadcast:
         raise HTTPException(status_code=404, detail="Broadcast not found")
+    if broadcast["status"] in ("queued", "sending"):
+        raise HTTPException(status_code=409, detail="Broadcast is already being sent")
     
     # Get page
     page = await db.facebook_pages.find_one({"page_id": broadcast['page_id']}, {"_id": 0})
     if not page or not page.get('access_token'):
         raise HTTPException(status_code=400, detail="Page not connected or missing access token")
     
-    # Get subscribers
-    query = {"page_id": broadcast["page_id"], "subscribed": True}
-    if broadcast["target_audience"] == "tags" and broadcast["target_tags"]:
-        query["tags"] = {"$in": broadcast["target_tags"]}
-    
-    subscribers = await db.subscribers.find(query, {"_id": 0}).to_list(10000)
-    total = len(subscribers)
-    sent_count = 0
-    
-    # Send messages
-    for subscriber in subscribers:
-        message_content = broadcast['message']
-        
-        # Build message
-        if message_content.get('cards') and len(message_content['cards']) > 0:
-            # Send cards
-            elements = []
-            for card in message_content['cards'][:10]:
-                element = {
-                    "title": card.get('title', ''),
-                    "subtitle": card.get('subtitle', ''),
-                    "image_url": card.get('image_url', ''),
-                    "buttons": []
-                }
-                for btn in card.get('buttons', [])[:3]:
-                    element['buttons'].append({
-                        "type": "web_url",
-                        "url": btn['url'],
-                        "title": btn['title']
-                    })
-                elements.append(element)
-            
-            msg_data = {
-                "attachment": {
-                    "type": "template",
-                    "payload": {
-                        "template_type": "generic",
-                        "elements": elements
-                    }
-                }
-            }
-            result = await send_facebook_message(subscriber['psid'], msg_data, page['access_token'])
-            if result['success']:
-                sent_count += 1
-        else:
-            # Send text message
-            msg_data = {"text": message_content.get('text', '')}
-            if message_content.get('buttons'):
-                msg_data['quick_replies'] = [
-                    {"content_type": "text", "title": btn['title'], "payload": btn.get('url', '')}
-                    for btn in message_content['buttons'][:11]
-                ]
-            
-            result = await send_facebook_message(subscriber['psid'], msg_data, page['access_token'])
-            if result['success']:
-                sent_count += 1
-        
-        # Send clickable image if exists
-        if message_content.get('clickable_image') and message_content['clickable_image'].get('url'):
-            img_msg = {
-                "attachment": {
-                    "type": "template",
-                    "payload": {
-                        "template_type": "button",
-                        "text": message_content.get('text', 'تحقق من هذا!'),
-                        "buttons": [{
-                            "type": "web_url",
-                            "url": message_content['clickable_image'].get('click_url', '#'),
-                            "title": "اضغط هنا"
-                        }]
-                    }
-                }
-            }
-            await send_facebook_message(subscriber['psid'], img_msg, page['access_token'])
+    job = BroadcastJob(broadcast_id=broadcast_id, user_id=current_user.id, page_id=broadcast["page_id"])
+    await db.broadcast_jobs.insert_one(job.model_dump())
+    await db.broadcasts.update_one({"id": broadcast_id}, {"$set": {"status": "queued", "job_id": job.id}})
+    if _broadcast_job_wakeup is not None:
+        _broadcast_job_wakeup.set()
     
-    # Update broadcast status
-    await db.broadcasts.update_one(
-        {"id": broadcast_id},
-        {"$set": {
-            "status": "sent",
-            "sent_at": datetime.now(timezone.utc).isoformat(),
-            "total_recipients": total,
-            "sent_count": sent_count,
-            "delivered_count": sent_count
-        }}
+    return {"success": True, "job_id": job.id, "status": job.status}
+
+@api_router.get("/broadcasts/{broadcast_id}/job", response_model=BroadcastJob)
+async def get_broadcast_job(broadcast_id: str, current_user: User = Depends(get_current_user)):
+    job = await db.broadcast_jobs.find_one(
+        {"broadcast_id": broadcast_id, "user_id": current_user.id},
+        {"_id": 0},
+        sort=[("created_at", -1)]
     )
-    
-    return {"success": True, "total_recipients": total, "sent_count": sent_count}
+    if not job:
+        raise HTTPException(status_code=404, detail="Broadcast job not found")
+    return BroadcastJob(**job)
 
 @api_router.delete("/broadcasts/{broadcast_id}")
 async def delete_broadcast(broadcast_id: str, current_user: User = Depends(get_current_user)):
-    result = await db.broadcasts.delete_one({"id": broadcast_id, "user_id": current_user.id})
-    if result.deleted_count == 0:
+    broadcast = await db.broadcasts.find_one_and_delete(
+        {"id": broadcast_id, "user_id": current_user.id},
+        projection={"_id": 0, "page_id": 1}
+    )
+    if not broadcast:
         raise HTTPException(status_code=404, detail="Broadcast not found")
+    bump_counters(current_user.id, broadcast["page_id"], broadcasts=-1)
     return {"success": True}
 
+# Dead letters
+async def redrive_dead_letters(redrive_id: str):
+    """Re-send every dead letter claimed by one redrive with its stored body; no audience is re-selected"""
+    pages: Dict[str, Optional[Dict]] = {}
+    redriven: Dict[tuple, int] = {}
+
+    async def resend(letters: List[Dict]) -> List[Dict]:
+        # A redrive is scoped to one broadcast or page, but group by page to be safe
+        by_page: Dict[str, List[int]] = {}
+        for i, letter in enumerate(letters):
+            by_page.setdefault(letter["page_id"], []).append(i)
+        results: List[Optional[Dict]] = [None] * len(letters)
+        for page_id, indexes in by_page.items():
+            if page_id not in pages:
+                page = await get_cached_page(page_id)
+                pages[page_id] = page if page and page.get("access_token") else None
+            if pages[page_id]:
+                sent_at = int(time.time() * 1000)
+                outcomes = await send_message_batch(
+                    [(letters[i]["recipient_id"], letters[i]["body"].encode()) for i in indexes], pages[page_id]
+                )
+            else:
+                outcomes = [{"success": False, "error": "Page not connected or missing access token", "retryable": False}] * len(indexes)
+            for i, outcome in zip(indexes, outcomes):
+                results[i] = outcome
+                # Receipts are counted for the main broadcast message only, not the clickable image
+                if letters[i]["source"] == "broadcast" and pages[page_id]:
+                    track_broadcast_message(letters[i]["broadcast_id"], page_id, letters[i]["recipient_id"], sent_at, outcome)
+
+        now = datetime.now(timezone.utc).isoformat()
+        for letter, result in zip(letters, results):
+            if result["success"]:
+                # Broadcast jobs count each recipient's main message only, not its clickable image
+                if letter["source"] != "broadcast_image":
+                    key = (letter["page_id"], letter.get("broadcast_id") if letter["source"] == "broadcast" else None)
+                    redriven[key] = redriven.get(key, 0) + 1
+                update = {"$set": {"status": "redriven", "updated_at": now}}
+            else:
+                update = {
+                    "$set": {"status": "pending", "error": result["error"], "retryable": result["retryable"], "updated_at": now},
+                    "$inc": {"attempts": result.get("attempts", 1)}
+                }
+            write_batcher.add("dead_letters", UpdateOne({"id": letter["id"]}, update))
+        return results
+
+    batch_size = max(BROADCAST_BATCH_SIZE, BROADCAST_CONCURRENCY * GRAPH_BATCH_SIZE)
+    cursor = db.dead_letters.find({"redrive_id": redrive_id}, {"_id": 0}).batch_size(batch_size)
+    batch = []
+    async for letter in cursor:
+        batch.append(letter)
+        if len(batch) >= batch_size:
+            await fan_out_batches(batch, resend, asyncio.Semaphore(BROADCAST_CONCURRENCY))
+            batch = []
+    if batch:
+        await fan_out_batches(batch, resend, asyncio.Semaphore(BROADCAST_CONCURRENCY))
+
+    for (page_id, broadcast_id), count in redriven.items():
+        record_analytics(page_id, outbound=count)
+        if broadcast_id:
+            await db.broadcasts.update_one({"id": broadcast_id}, {"$inc": {"sent_count": count}})
+
+@api_router.get("/dead-letters", response_model=List[DeadLetter])
+async def get_dead_letters(
+    broadcast_id: Optional[str] = None,
+    page_id: Optional[str] = None,
+    status: str = "pending",
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: User = Depends(get_current_user)
+):
+    query = {"user_id": current_user.id, "status": status}
+    if broadcast_id:
+        query["broadcast_id"] = broadcast_id
+    if page_id:
+        query["page_id"] = page_id
+    return await db.dead_letters.find(query, {"_id": 0}).limit(limit).to_list(limit)
+
+@api_router.post("/dead-letters/redrive")
+async def redrive(input: DeadLetterRedrive, current_user: User = Depends(get_current_user)):
+    """Replay the pending dead letters of a broadcast or page in the background"""
+    if not input.broadcast_id and not input.page_id:
+        raise HTTPException(status_code=400, detail="broadcast_id or page_id is required")
+    query = {"user_id": current_user.id}
+    if input.broadcast_id:
+        query["broadcast_id"] = input.broadcast_id
+    if input.page_id:
+        query["page_id"] = input.page_id
+    now = time.time()
+    # Claiming by update_many keeps concurrent redrives from sending the same letter twice;
+    # letters left "redriving" by a crashed process become claimable when their lease expires
+    redrive_id = str(uuid.uuid4())
+    claimed = await db.dead_letters.update_many(
+        {**query, "$or": [
+            {"status": "pending"},
+            {"status": "redriving", "lease_expires_at": {"$lt": now}}
+        ]},
+        {"$set": {
+            "status": "redriving",
+            "redrive_id": redrive_id,
+            "lease_expires_at": now + DEAD_LETTER_REDRIVE_LEASE_SECONDS
+        }}
+    )
+    if claimed.modified_count:
+        _background_tasks[:] = [task for task in _background_tasks if not task.done()]
+        _background_tasks.append(asyncio.create_task(redrive_dead_letters(redrive_id)))
+    return {"success": True, "redrive_id": redrive_id, "queued": claimed.modified_count}
+
 # Automations
 @api_router.post("/automations", response_model=Automation)
 async def create_automation(input: AutomationCreate, current_user: User = Depends(get_current_user)):
     automation = Automation(user_id=current_user.id, **input.model_dump())
     doc = automation.model_dump()
     await db.automations.insert_one(doc)
+    invalidate_automation_snapshot(automation.page_id)
     return automation
 
 @api_router.get("/automations", response_model=List[Automation])
@@ -701,19 +2743,25 @@ async def get_automations(page_id: Optional[str] = None, current_user: User = De
 
 @api_router.patch("/automations/{automation_id}")
 async def toggle_automation(automation_id: str, is_active: bool, current_user: User = Depends(get_current_user)):
-    result = await db.automations.update_one(
+    automation = await db.automations.find_one_and_update(
         {"id": automation_id, "user_id": current_user.id},
-        {"$set": {"is_active": is_active}}
+        {"$set": {"is_active": is_active}},
+        projection={"_id": 0, "page_id": 1}
     )
-    if result.matched_count == 0:
+    if not automation:
         raise HTTPException(status_code=404, detail="Automation not found")
+    invalidate_automation_snapshot(automation["page_id"])
     return {"success": True}
 
 @api_router.delete("/automations/{automation_id}")
 async def delete_automation(automation_id: str, current_user: User = Depends(get_current_user)):
-    result = await db.automations.delete_one({"id": automation_id, "user_id": current_user.id})
-    if result.deleted_count == 0:
+    automation = await db.automations.find_one_and_delete(
+        {"id": automation_id, "user_id": current_user.id},
+        projection={"_id": 0, "page_id": 1}
+    )
+    if not automation:
         raise HTTPException(status_code=404, detail="Automation not found")
+    invalidate_automation_snapshot(automation["page_id"])
     return {"success": True}
 
 # Messages
@@ -721,35 +2769,152 @@ async def delete_automation(automation_id: str, current_user: User = Depends(get
 async def create_message(input: MessageCreate, current_user: User = Depends(get_current_user)):
     message = Message(**input.model_dump())
     doc = message.model_dump()
+    inbox_hub.publish(current_user.id, "message", doc)
     await db.messages.insert_one(doc)
+    bump_counters(current_user.id, message.page_id, messages=1)
+    if message.sender == "subscriber":
+        record_analytics(message.page_id, inbound=1)
+    else:
+        record_analytics(message.page_id, outbound=1)
     return message
 
+def normalize_timestamp(value: str) -> str:
+    """An ISO 8601 timestamp in the UTC isoformat() form created_at is stored in, so string comparison holds"""
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid timestamp")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).isoformat()
+
 @api_router.get("/messages")
-async def get_messages(subscriber_id: str, current_user: User = Depends(get_current_user)):
-    messages = await db.messages.find({"subscriber_id": subscriber_id}, {"_id": 0}).sort("created_at", 1).to_list(1000)
-    return messages
+async def get_messages(
+    subscriber_id: str,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    since: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    current_user: User = Depends(get_current_user)
+):
+    """Conversation history, newest first, paged by (created_at, id) cursors.
+
+    No cursor returns the latest `limit` messages; `before` pages towards older
+    messages and `after` towards newer ones. `since` (an ISO timestamp) is the
+    incremental-sync mode: only messages created after it, oldest first.
+    `next_after` is the cursor of the newest returned message.
+    """
+    if sum(param is not None for param in (before, after, since)) > 1:
+        raise HTTPException(status_code=400, detail="Use only one of before, after and since")
+    subscriber = await db.subscribers.find_one({"id": subscriber_id, "user_id": current_user.id}, {"_id": 0, "id": 1})
+    if not subscriber:
+        raise HTTPException(status_code=404, detail="Subscriber not found")
+    
+    query = {"subscriber_id": subscriber_id}
+    newest_first = True
+    if before:
+        created_at, last_id = decode_cursor(before, 2)
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "id": {"$lt": last_id}}
+        ]
+    elif after:
+        created_at, last_id = decode_cursor(after, 2)
+        query["$or"] = [
+            {"created_at": {"$gt": created_at}},
+            {"created_at": created_at, "id": {"$gt": last_id}}
+        ]
+        newest_first = False
+    elif since:
+        query["created_at"] = {"$gt": normalize_timestamp(since)}
+        newest_first = False
+    
+    direction = -1 if newest_first else 1
+    messages = await db.messages.find(query, {"_id": 0}).sort(
+        [("created_at", direction), ("id", direction)]
+    ).limit(limit + 1).to_list(limit + 1)
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if after:
+        # Fetched oldest-first to stay next to the cursor; return newest first like other pages
+        messages.reverse()
+    
+    next_after = after
+    if messages:
+        newest = messages[-1] if since else messages[0]
+        next_after = encode_cursor(newest["created_at"], newest["id"])
+    if newest_first and has_more:
+        next_before = encode_cursor(messages[-1]["created_at"], messages[-1]["id"])
+    else:
+        next_before = None
+    return JSONResponse({
+        "items": messages,
+        "has_more": has_more,
+        "next_before": next_before,
+        "next_after": next_after,
+    })
 
 # Stats
 @api_router.get("/stats", response_model=Stats)
 async def get_stats(page_id: Optional[str] = None, current_user: User = Depends(get_current_user)):
-    query = {"user_id": current_user.id}
-    if page_id:
-        query["page_id"] = page_id
-    
-    total_subscribers = await db.subscribers.count_documents(query)
-    active_subscribers = await db.subscribers.count_documents({**query, "subscribed": True})
-    total_messages = await db.messages.count_documents({"page_id": page_id} if page_id else {})
-    total_broadcasts = await db.broadcasts.count_documents(query)
-    total_flows = await db.flows.count_documents(query)
+    key = f"page:{current_user.id}:{page_id}" if page_id else f"user:{current_user.id}"
+    counters = await db.counters.find_one({"key": key}, {"_id": 0})
+    if not (counters or {}).get("reconciled"):
+        # Never recounted (missing, or only holding increments since): backfill from the source collections
+        await reconcile_counters(current_user.id, [page_id] if page_id else [])
+        counters = await db.counters.find_one({"key": key}, {"_id": 0}) or {}
     
     return Stats(
-        total_subscribers=total_subscribers,
-        active_subscribers=active_subscribers,
-        total_messages=total_messages,
-        total_broadcasts=total_broadcasts,
-        total_flows=total_flows
+        total_subscribers=counters.get("subscribers", 0),
+        active_subscribers=counters.get("active_subscribers", 0),
+        total_messages=counters.get("messages", 0),
+        total_broadcasts=counters.get("broadcasts", 0),
+        total_flows=counters.get("flows", 0)
     )
 
+@api_router.get("/analytics", response_model=Analytics)
+async def get_analytics(
+    page_id: str,
+    start: int = Query(..., ge=0, description="Range start, epoch milliseconds"),
+    end: int = Query(..., ge=0, description="Range end (exclusive), epoch milliseconds"),
+    granularity: str = Query("auto", pattern="^(auto|hour|day)$"),
+    current_user: User = Depends(get_current_user)
+):
+    """Per-page message and subscriber time series from the hourly/daily rollups"""
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    page = await db.facebook_pages.find_one({"page_id": page_id, "user_id": current_user.id}, {"_id": 0, "id": 1})
+    if not page:
+        raise HTTPException(status_code=404, detail="Page not found")
+    if granularity == "auto":
+        granularity = "hour" if end - start <= 7 * ANALYTICS_BUCKET_MS["day"] else "day"
+    size = ANALYTICS_BUCKET_MS[granularity]
+    first = start - start % size
+    if (end - first) // size > ANALYTICS_MAX_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"Range spans more than {ANALYTICS_MAX_BUCKETS} {granularity} buckets")
+    
+    stored = {}
+    async for bucket in db.analytics.find(
+        {"page_id": page_id, "granularity": granularity, "bucket": {"$gte": first, "$lt": end}},
+        {"_id": 0}
+    ):
+        stored[bucket["bucket"]] = bucket
+    
+    buckets = []
+    totals = dict.fromkeys(ANALYTICS_FIELDS, 0)
+    for t in range(first, end, size):
+        values = {field: stored.get(t, {}).get(field, 0) for field in ANALYTICS_FIELDS}
+        for field, value in values.items():
+            totals[field] += value
+        buckets.append(AnalyticsBucket(t=t, **values))
+    return Analytics(page_id=page_id, granularity=granularity, start=start, end=end, buckets=buckets, totals=totals)
+
+@api_router.post("/stats/reconcile", response_model=Stats)
+async def reconcile_stats(page_id: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    """Recount the caller's counters now instead of waiting for the periodic reconciliation"""
+    await reconcile_counters(current_user.id, [page_id] if page_id else [])
+    return await get_stats(page_id, current_user)
+
 app.include_router(api_router)
 
 app.add_middleware(
@@ -766,6 +2931,82 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup_graph_client():
+    get_graph_client()
+
+@app.on_event("startup")
+async def startup_indexes():
+    await ensure_indexes()
+
+@app.on_event("startup")
+async def startup_webhook_workers():
+    for _ in range(WEBHOOK_WORKERS):
+        queue = asyncio.Queue(maxsize=max(1, WEBHOOK_QUEUE_SIZE // WEBHOOK_WORKERS))
+        _webhook_queues.append(queue)
+        _webhook_tasks.append(asyncio.create_task(webhook_worker(queue)))
+
+@app.on_event("startup")
+async def startup_counter_reconciliation():
+    if COUNTER_RECONCILE_SECONDS > 0:
+        _background_tasks.append(asyncio.create_task(counter_reconcile_worker()))
+
+@app.on_event("startup")
+async def startup_receipt_flush():
+    _background_tasks.append(asyncio.create_task(receipt_flush_worker()))
+
+@app.on_event("startup")
+async def startup_broadcast_workers():
+    global _broadcast_job_wakeup
+    _broadcast_job_wakeup = asyncio.Event()
+    for _ in range(BROADCAST_JOB_WORKERS):
+        _broadcast_job_tasks.append(asyncio.create_task(broadcast_job_worker()))
+
+@app.on_event("shutdown")
+async def shutdown_webhook_workers():
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(*(queue.join() for queue in _webhook_queues)),
+            timeout=WEBHOOK_DRAIN_SECONDS
+        )
+    except asyncio.TimeoutError:
+        pending = sum(queue.qsize() for queue in _webhook_queues)
+        logging.warning(f"Dropping {pending} unprocessed webhook events on shutdown")
+    for task in _webhook_tasks:
+        task.cancel()
+    await asyncio.gather(*_webhook_tasks, return_exceptions=True)
+    _webhook_tasks.clear()
+    _webhook_queues.clear()
+
+@app.on_event("shutdown")
+async def shutdown_background_tasks():
+    for task in _background_tasks:
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    _background_tasks.clear()
+
+@app.on_event("shutdown")
+async def shutdown_broadcast_workers():
+    for task in _broadcast_job_tasks:
+        task.cancel()
+    await asyncio.gather(*_broadcast_job_tasks, return_exceptions=True)
+    _broadcast_job_tasks.clear()
+
+@app.on_event("shutdown")
+async def shutdown_write_batcher():
+    await write_batcher.close()
+
+@app.on_event("shutdown")
+async def shutdown_password_executor():
+    _password_executor.shutdown(wait=False, cancel_futures=True)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    client.close()
+
+@app.on_event("shutdown")
+async def shutdown_graph_client():
+    global _graph_client
+    if _graph_client is not None:
+        await _graph_client.aclose()
+        _graph_client = None
\ No newline at end of file
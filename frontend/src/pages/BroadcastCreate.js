@@ -54,7 +54,7 @@ export default function BroadcastCreate() {
     try {
       const res = await axios.post(`${API}/broadcasts`, { ...broadcast, page_id: pageId });
       await axios.post(`${API}/broadcasts/${res.data.id}/send`);
-      toast.success('تم إرسال Broadcast بنجاح!');
+      toast.success('تمت إضافة Broadcast إلى قائمة الإرسال');
       navigate('/broadcasts');
     } catch (error) {
       toast.error('فشل إرسال Broadcast');
@@ -236,6 +236,9 @@ export default function BroadcastCreate() {
                   rows={4}
                   data-testid="broadcast-text-input"
                 />
+                <p className="text-xs text-gray-500">
+                  {'يمكنك استخدام {first_name} و {last_name} لتخصيص الرسالة لكل مشترك'}
+                </p>
               </div>
             </CardContent>
           </Card>
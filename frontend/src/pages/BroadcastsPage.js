@@ -50,7 +50,7 @@ export default function BroadcastsPage() {
     if (!window.confirm('هل أنت متأكد من إرسال هذا Broadcast الآن؟')) return;
     try {
       await axios.post(`${API}/broadcasts/${id}/send`);
-      toast.success('تم إرسال Broadcast بنجاح!');
+      toast.success('تمت إضافة Broadcast إلى قائمة الإرسال');
       loadBroadcasts();
     } catch (error) {
       toast.error('فشل إرسال Broadcast');
@@ -61,14 +61,18 @@ export default function BroadcastsPage() {
     const styles = {
       'draft': 'bg-gray-100 text-gray-700',
       'scheduled': 'bg-blue-100 text-blue-700',
+      'queued': 'bg-blue-100 text-blue-700',
       'sending': 'bg-yellow-100 text-yellow-700',
-      'sent': 'bg-emerald-100 text-emerald-700'
+      'sent': 'bg-emerald-100 text-emerald-700',
+      'failed': 'bg-red-100 text-red-700'
     };
     const labels = {
       'draft': 'مسودة',
       'scheduled': 'مجدول',
+      'queued': 'في قائمة الانتظار',
       'sending': 'قيد الإرسال',
-      'sent': 'تم الإرسال'
+      'sent': 'تم الإرسال',
+      'failed': 'فشل الإرسال'
     };
     return (
       <span className={`text-xs px-2 py-1 rounded ${styles[status] || styles.draft}`}>
@@ -50,7 +50,7 @@ export default function FlowBuilder() {
       await axios.patch(`${API}/flows/${flowId}`, { steps: flow.steps });
       toast.success('تم حفظ Flow بنجاح!');
     } catch (error) {
-      toast.error('فشل حفظ Flow');
+      toast.error(error.response?.data?.detail || 'فشل حفظ Flow');
     }
   };
 
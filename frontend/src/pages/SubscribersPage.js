@@ -2,12 +2,15 @@ import { useState, useEffect } from 'react';
 import axios from 'axios';
 import { Card, CardContent } from '@/components/ui/card';
 import { Input } from '@/components/ui/input';
+import { Button } from '@/components/ui/button';
 import { Users, Search, Tag } from 'lucide-react';
 import { toast } from 'sonner';
 import { API } from '@/App';
 
 export default function SubscribersPage() {
   const [subscribers, setSubscribers] = useState([]);
+  const [nextAfter, setNextAfter] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [loading, setLoading] = useState(true);
   const [searchTerm, setSearchTerm] = useState('');
 
@@ -22,11 +25,13 @@ export default function SubscribersPage() {
       const pageId = localStorage.getItem('selectedPageId');
       if (!pageId) {
         setSubscribers([]);
+        setNextAfter(null);
         setLoading(false);
         return;
       }
       const res = await axios.get(`${API}/subscribers?page_id=${pageId}`);
-      setSubscribers(res.data);
+      setSubscribers(res.data.items);
+      setNextAfter(res.data.next_after);
     } catch (error) {
       toast.error('فشل تحميل المشتركين');
     } finally {
@@ -34,6 +39,21 @@ export default function SubscribersPage() {
     }
   };
 
+  const loadMoreSubscribers = async () => {
+    const pageId = localStorage.getItem('selectedPageId');
+    if (!pageId || !nextAfter) return;
+    setLoadingMore(true);
+    try {
+      const res = await axios.get(`${API}/subscribers?page_id=${pageId}&after=${encodeURIComponent(nextAfter)}`);
+      setSubscribers(prev => [...prev, ...res.data.items]);
+      setNextAfter(res.data.next_after);
+    } catch (error) {
+      toast.error('فشل تحميل المشتركين');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const filteredSubscribers = subscribers.filter(sub => {
     const fullName = `${sub.first_name || ''} ${sub.last_name || ''}`.toLowerCase();
     return fullName.includes(searchTerm.toLowerCase());
@@ -178,6 +198,18 @@ export default function SubscribersPage() {
                 </div>
               ))}
             </div>
+            {nextAfter && (
+              <div className="p-4 flex justify-center">
+                <Button
+                  onClick={loadMoreSubscribers}
+                  variant="outline"
+                  disabled={loadingMore}
+                  data-testid="load-more-subscribers"
+                >
+                  تحميل المزيد
+                </Button>
+              </div>
+            )}
           </CardContent>
         </Card>
       )}
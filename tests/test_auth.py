@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import server
+from server import authenticate_token, create_token, invalidate_user_cache
+
+
+@pytest.fixture
+def token_cache(monkeypatch):
+    cache = server.TTLCache(maxsize=10, ttl=60)
+    monkeypatch.setattr(server, "_token_cache", cache)
+    return cache
+
+async def insert_user(db, user_id, name):
+    await db.users.insert_one({"id": user_id, "email": f"{user_id}@example.com", "name": name, "password": "hash"})
+
+def test_verified_token_is_served_from_cache(db, token_cache):
+    token = create_token("u1")
+
+    async def run():
+        await insert_user(db, "u1", "Before")
+        first = await authenticate_token(token)
+        await db.users.update_one({"id": "u1"}, {"$set": {"name": "After"}})
+        return first, await authenticate_token(token)
+
+    first, second = asyncio.run(run())
+    assert first.name == second.name == "Before"
+
+def test_invalidate_user_cache_drops_only_that_users_sessions(db, token_cache):
+    tokens = [create_token("u1"), create_token("u2")]
+
+    async def run():
+        await insert_user(db, "u1", "Before")
+        await insert_user(db, "u2", "Other")
+        for token in tokens:
+            await authenticate_token(token)
+        await db.users.update_one({"id": "u1"}, {"$set": {"name": "After"}})
+        invalidate_user_cache("u1")
+        assert tokens[0] not in token_cache and tokens[1] in token_cache
+        return await authenticate_token(tokens[0])
+
+    assert asyncio.run(run()).name == "After"
+
+def test_deleted_user_is_rejected_once_invalidated(db, token_cache):
+    token = create_token("u1")
+
+    async def run():
+        await insert_user(db, "u1", "Gone")
+        await authenticate_token(token)
+        await db.users.delete_one({"id": "u1"})
+        invalidate_user_cache("u1")
+        await authenticate_token(token)
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(run())
+    assert exc.value.status_code == 401
+
+def test_invalid_token_is_rejected(token_cache):
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(authenticate_token("not-a-jwt"))
+    assert exc.value.status_code == 401
@@ -0,0 +1,135 @@
+import asyncio
+
+import pytest
+
+import server
+from server import BroadcastJob, run_under_lease
+
+
+@pytest.fixture
+def short_lease(monkeypatch):
+    monkeypatch.setattr(server, "BROADCAST_JOB_LEASE_SECONDS", 0.03)
+
+async def insert_job(db, lease_owner="mine", **fields):
+    job = BroadcastJob(broadcast_id="B", user_id="U", page_id="P", status="sending", lease_owner=lease_owner, **fields).model_dump()
+    await db.broadcast_jobs.insert_one(dict(job))
+    return job
+
+def endless_send(cancelled: asyncio.Event):
+    async def send():
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+    return send()
+
+def test_lease_renewed_while_batch_runs(db, short_lease):
+    async def run():
+        job = await insert_job(db)
+
+        async def send():
+            await asyncio.sleep(0.05)
+            return "done"
+        return await run_under_lease(job, send()), await db.broadcast_jobs.find_one({"id": job["id"]})
+
+    (result, held), stored = asyncio.run(run())
+    assert (result, held) == ("done", True)
+    assert stored["lease_expires_at"] > 0
+
+def test_lost_lease_cancels_batch(db, short_lease):
+    async def run():
+        job = await insert_job(db)
+        await db.broadcast_jobs.update_one({"id": job["id"]}, {"$set": {"lease_owner": "someone-else"}})
+        cancelled = asyncio.Event()
+        outcome = await run_under_lease(job, endless_send(cancelled))
+        return outcome, cancelled.is_set()
+
+    assert asyncio.run(run()) == ((None, False), True)
+
+def test_cancelled_worker_cancels_batch(db, short_lease):
+    async def run():
+        job = await insert_job(db)
+        cancelled = asyncio.Event()
+        worker = asyncio.ensure_future(run_under_lease(job, endless_send(cancelled)))
+        await asyncio.sleep(0.05)
+        worker.cancel()
+        await asyncio.gather(worker, return_exceptions=True)
+        await asyncio.sleep(0)
+        return cancelled.is_set()
+
+    assert asyncio.run(run())
+
+def test_stale_claim_cannot_checkpoint_or_finish(db):
+    async def run():
+        job = await insert_job(db, sent_count=1)
+        await db.broadcasts.insert_one({"id": "B", "status": "sending"})
+        stale = {**job, "lease_owner": "previous-claim"}
+        checkpointed = await server.checkpoint_broadcast_job(stale, {"$inc": {"sent_count": 5}})
+        await server.finish_broadcast_job(stale, "sent")
+        return checkpointed, await db.broadcast_jobs.find_one({"id": job["id"]}), await db.broadcasts.find_one({"id": "B"})
+
+    checkpointed, stored, broadcast = asyncio.run(run())
+    assert not checkpointed
+    assert (stored["status"], stored["sent_count"]) == ("sending", 1)
+    assert broadcast["status"] == "sending"
+
+@pytest.fixture
+def sent_to(db, monkeypatch):
+    """Recipients of the main message of a broadcast job, with sends that succeed"""
+    monkeypatch.setattr(server, "global_circuit", server.CircuitBreaker(window=server.CIRCUIT_GLOBAL_WINDOW))
+    monkeypatch.setattr(server, "_page_circuits", {})
+    monkeypatch.setattr(server, "_page_send_limits", {})
+    recipients = []
+
+    async def send_message_batch(messages, page, dead_letter=None):
+        await asyncio.sleep(0.01)
+        recipients.extend(psid for psid, _ in messages)
+        return [{"success": True, "data": {"message_id": f"m{psid}"}, "attempts": 1} for psid, _ in messages]
+    monkeypatch.setattr(server, "send_message_batch", send_message_batch)
+    return recipients
+
+async def seed_broadcast(db, subscribers=5):
+    await db.facebook_pages.insert_one({"id": "p", "page_id": "P", "user_id": "U", "access_token": "T"})
+    await db.broadcasts.insert_one({
+        "id": "B", "user_id": "U", "page_id": "P", "name": "b", "message": {"text": "Hi {first_name}"},
+        "target_audience": "all", "target_tags": [], "status": "sending"
+    })
+    await db.subscribers.insert_many([
+        {"id": f"s{i}", "user_id": "U", "page_id": "P", "psid": str(i), "first_name": f"N{i}", "subscribed": True}
+        for i in range(1, subscribers + 1)
+    ])
+
+def test_job_records_throughput(db, sent_to):
+    async def run():
+        await seed_broadcast(db)
+        job = await insert_job(db)
+        await server.run_broadcast_job(job)
+        return await server.get_broadcast_job("B", server.User(id="U", email="a@example.com", name="A"))
+
+    job = asyncio.run(run())
+    assert sent_to == ["1", "2", "3", "4", "5"]
+    assert (job.status, job.sent_count) == ("sent", 5)
+    assert job.messages_per_second == round(5 / job.duration_seconds, 2) > 0
+
+def test_resumed_job_settles_interrupted_batch_without_resending(db, sent_to):
+    async def run():
+        await seed_broadcast(db)
+        # Before the interruption "1" was sent and "2" failed; what happened to "3" is unknown
+        await db.broadcast_messages.insert_one({"mid": "m1", "broadcast_id": "B", "page_id": "P", "psid": "1"})
+        await db.dead_letters.insert_one({"id": "d2", "broadcast_id": "B", "source": "broadcast", "recipient_id": "2", "status": "pending"})
+        job = await insert_job(db, pending_batch=["1", "2", "3"])
+        await server.run_broadcast_job(job)
+        await server.write_batcher.flush()
+        return (
+            await db.broadcast_jobs.find_one({"id": job["id"]}, {"_id": 0}),
+            await db.broadcasts.find_one({"id": "B"}, {"_id": 0}),
+            await db.dead_letters.find({"recipient_id": "3"}, {"_id": 0}).to_list(10)
+        )
+
+    job, broadcast, [unknown] = asyncio.run(run())
+    assert sent_to == ["4", "5"]
+    assert job["pending_batch"] is None and job["status"] == "sent"
+    assert (job["total_recipients"], job["sent_count"], job["failed_count"], job["skipped_count"]) == (5, 3, 1, 1)
+    assert (broadcast["status"], broadcast["sent_count"]) == ("sent", 3)
+    assert (unknown["source"], unknown["body"], unknown["status"]) == ("broadcast", '{"text":"Hi N3"}', "pending")
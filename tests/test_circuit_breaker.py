@@ -0,0 +1,63 @@
+import server
+from server import CircuitBreaker
+
+
+def test_circuit_opens_once_half_the_window_mostly_failed():
+    circuit = CircuitBreaker(window=10)
+    for _ in range(4):
+        circuit.record(False)
+    assert circuit.state == "closed"
+    circuit.record(False)
+    assert circuit.state == "open"
+    assert circuit.trips == 1
+    assert not circuit.allow()
+    assert circuit.retry_in() > 0
+
+def test_circuit_stays_closed_below_failure_rate():
+    circuit = CircuitBreaker(window=10)
+    for ok in [True, True, True, False, True, False, True, True, False, True]:
+        circuit.record(ok)
+    assert circuit.state == "closed"
+
+def open_expired_circuit():
+    circuit = CircuitBreaker(window=2)
+    circuit.record(False)
+    assert circuit.state == "open"
+    circuit.opened_at -= server.CIRCUIT_OPEN_SECONDS
+    return circuit
+
+def test_half_open_probe_success_closes_circuit():
+    circuit = open_expired_circuit()
+    assert circuit.allow()
+    assert circuit.state == "half_open"
+    assert not circuit.allow()  # the single probe slot is taken
+    circuit.record(True)
+    assert circuit.state == "closed"
+    assert circuit.allow()
+
+def test_half_open_probe_failure_reopens_circuit():
+    circuit = open_expired_circuit()
+    assert circuit.allow()
+    circuit.record(False)
+    assert circuit.state == "open"
+    assert circuit.trips == 2
+    assert not circuit.allow()
+
+def test_released_probe_slot_can_be_taken_again():
+    circuit = open_expired_circuit()
+    assert circuit.allow()
+    circuit.release()
+    assert circuit.allow()
+
+def test_page_circuits_are_per_page(monkeypatch):
+    monkeypatch.setattr(server, "_page_circuits", {})
+    assert server.get_page_circuit("P") is server.get_page_circuit("P")
+    assert server.get_page_circuit("P") is not server.get_page_circuit("Q")
+
+def test_refusal_by_page_circuit_gives_back_global_probe(monkeypatch):
+    monkeypatch.setattr(server, "global_circuit", open_expired_circuit())
+    page_circuit = CircuitBreaker(window=2)
+    page_circuit.trip()
+    assert server.circuit_refusal(page_circuit) == "Circuit open: page"
+    assert server.global_circuit.probes == 0
+    assert server.circuit_refusal(CircuitBreaker()) is None
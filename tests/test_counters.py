@@ -0,0 +1,58 @@
+import asyncio
+
+import server
+from server import User, bump_counters, get_stats, reconcile_counters
+
+
+def seed(db, user, subscribers=50, flows=1):
+    async def insert():
+        await db.facebook_pages.insert_one({"id": "p", "page_id": "P", "user_id": user.id, "access_token": "T"})
+        await db.subscribers.insert_many([
+            {"id": f"s{i}", "user_id": user.id, "page_id": "P", "psid": str(i), "subscribed": i % 5 != 0}
+            for i in range(subscribers)
+        ])
+        for i in range(flows):
+            await db.flows.insert_one({"id": f"f{i}", "user_id": user.id, "page_id": "P"})
+    return insert()
+
+def test_stats_backfill_counters_created_by_an_increment(db):
+    user = User(email="a@example.com", name="A")
+
+    async def run():
+        await seed(db, user)
+        # An inbound message before anyone read /stats creates the counter documents
+        await db.messages.insert_one({"id": "m", "page_id": "P"})
+        bump_counters(user.id, "P", messages=1)
+        await server.write_batcher.flush()
+        return await get_stats(None, user), await get_stats("P", user)
+
+    for stats in asyncio.run(run()):
+        assert (stats.total_subscribers, stats.active_subscribers) == (50, 40)
+        assert (stats.total_flows, stats.total_messages, stats.total_broadcasts) == (1, 1, 0)
+
+def test_reconcile_does_not_double_count_queued_increments(db):
+    user = User(email="a@example.com", name="A")
+
+    async def run():
+        await seed(db, user, subscribers=3, flows=0)
+        await reconcile_counters(user.id)
+        await db.subscribers.insert_one({"id": "new", "user_id": user.id, "page_id": "P", "psid": "x", "subscribed": True})
+        bump_counters(user.id, "P", subscribers=1, active_subscribers=1)
+        await reconcile_counters(user.id)
+        return await get_stats("P", user)
+
+    stats = asyncio.run(run())
+    assert (stats.total_subscribers, stats.active_subscribers) == (4, 3)
+
+def test_reconcile_repairs_drift(db):
+    user = User(email="a@example.com", name="A")
+
+    async def run():
+        await seed(db, user, subscribers=2, flows=2)
+        await reconcile_counters(user.id)
+        await db.counters.update_one({"key": f"user:{user.id}"}, {"$inc": {"flows": 5, "subscribers": -1}})
+        await reconcile_counters(user.id)
+        return await get_stats(None, user)
+
+    stats = asyncio.run(run())
+    assert (stats.total_subscribers, stats.total_flows) == (2, 2)
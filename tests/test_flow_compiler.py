@@ -0,0 +1,61 @@
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from server import compile_flow_steps, flow_button_payload
+
+
+def step(step_id, type="message", text=None, buttons=(), next_step_id=None, **content):
+    if type == "message":
+        content = {"text": text or step_id}
+    return {"id": step_id, "type": type, "content": content, "buttons": list(buttons), "next_step_id": next_step_id}
+
+def body(compiled_step):
+    return json.loads(compiled_step["body"])
+
+def test_steps_without_links_run_in_order():
+    compiled = compile_flow_steps([step("a"), step("b"), step("c")], "f")
+    assert [(s["id"], s["next"]) for s in compiled] == [("a", "b"), ("b", "c"), ("c", None)]
+    assert body(compiled[1]) == {"text": "b"}
+
+def test_delay_step_compiles_to_no_body():
+    compiled = compile_flow_steps([step("a"), step("wait", type="delay"), step("b")], "f")
+    assert compiled[1]["body"] is None
+    assert compiled[1]["next"] == "b"
+
+def test_branching_buttons_become_flow_payloads():
+    buttons = [
+        {"id": "yes", "title": "Yes", "next_step_id": "b"},
+        {"title": "Site", "url": "https://example.com"},
+    ]
+    compiled = compile_flow_steps([step("a", buttons=buttons), step("b", text="مرحبا")], "f")
+    assert body(compiled[0])["quick_replies"] == [
+        {"content_type": "text", "title": "Yes", "payload": flow_button_payload("f", "a", "yes")},
+        {"content_type": "text", "title": "Site", "payload": "https://example.com"},
+    ]
+    assert compiled[0]["buttons"] == [{"id": "yes", "title": "Yes", "next": "b"}]
+    # Linked flows only follow explicit links
+    assert compiled[0]["next"] is None
+    assert compiled[1]["body"] == '{"text":"مرحبا"}'
+
+def test_card_buttons_are_postbacks_or_links():
+    buttons = [{"title": "Next", "next_step_id": "b"}, {"title": "Site", "url": "https://example.com"}]
+    compiled = compile_flow_steps([step("a", type="card", title="T", buttons=buttons), step("b")], "f")
+    [element] = body(compiled[0])["attachment"]["payload"]["elements"]
+    assert element["buttons"] == [
+        {"type": "postback", "title": "Next", "payload": flow_button_payload("f", "a", "0")},
+        {"type": "web_url", "url": "https://example.com", "title": "Site"},
+    ]
+    assert compiled[0]["buttons"] == [{"id": "0", "title": "Next", "next": "b"}]
+
+@pytest.mark.parametrize("steps,detail", [
+    ([step("a", next_step_id="zz")], "Step a: next step zz does not exist"),
+    ([step("a", buttons=[{"title": "x", "next_step_id": "zz"}])], "Step a: button leads to unknown step zz"),
+    ([{"id": "a", "type": "message", "content": {}}], "Step a: message text is required"),
+    ([step("a", type="card", title="T", buttons=[{"title": "x"}])], "Step a: card buttons need a title and a url or next step"),
+])
+def test_invalid_steps_are_rejected(steps, detail):
+    with pytest.raises(HTTPException) as exc:
+        compile_flow_steps(steps, "f")
+    assert (exc.value.status_code, exc.value.detail) == (400, detail)
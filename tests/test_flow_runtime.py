@@ -0,0 +1,107 @@
+import asyncio
+import json
+
+import pytest
+
+import server
+from server import advance_flow, compile_flow_steps, flow_button_payload, get_flow_graph, run_flow
+
+PAGE = {"page_id": "P", "user_id": "U", "access_token": "T"}
+
+
+@pytest.fixture
+def sent(db, monkeypatch):
+    """Texts sent by the flow runtime, in order"""
+    monkeypatch.setattr(server, "_flow_graphs", server.TTLCache(maxsize=100, ttl=60))
+    monkeypatch.setattr(server, "_flow_sessions", server.TTLCache(maxsize=100, ttl=60))
+    texts = []
+
+    async def send_flow_step(recipient_id, step_body, page, dead_letter=None):
+        texts.append(json.loads(step_body)["text"])
+        return {"success": True}
+    monkeypatch.setattr(server, "send_flow_step", send_flow_step)
+    return texts
+
+def message(step_id, text, buttons=(), next_step_id=None):
+    return {"id": step_id, "type": "message", "content": {"text": text}, "buttons": list(buttons), "next_step_id": next_step_id}
+
+QUESTION = [
+    message("a", "Like it?", [
+        {"id": "y", "title": "Yes", "next_step_id": "b"},
+        {"id": "n", "title": "No", "next_step_id": "c"},
+    ]),
+    message("b", "Great", next_step_id="wait"),
+    {"id": "wait", "type": "delay", "content": {"seconds": 5}, "next_step_id": "d"},
+    message("d", "Bye"),
+    message("c", "Sorry"),
+]
+
+async def save_flow(db, steps, flow_id="f", **fields):
+    flow = {"id": flow_id, "page_id": "P", "version": 1, "is_active": True, "steps": steps,
+            "compiled_steps": compile_flow_steps(steps, flow_id), **fields}
+    await db.flows.insert_one(flow)
+    return await get_flow_graph(flow_id)
+
+async def session(db):
+    await server.write_batcher.flush()
+    return await db.flow_sessions.find_one({"page_id": "P", "psid": "1"}, {"_id": 0, "flow_id": 1, "step_id": 1})
+
+def test_flow_waits_at_a_step_with_buttons(db, sent):
+    async def run():
+        graph = await save_flow(db, QUESTION)
+        return await run_flow(PAGE, "1", graph, graph.entry), await session(db)
+
+    assert asyncio.run(run()) == (1, {"flow_id": "f", "step_id": "a"})
+    assert sent == ["Like it?"]
+
+def test_tapped_button_runs_its_branch_past_delay_steps(db, sent):
+    async def run():
+        graph = await save_flow(db, QUESTION)
+        await run_flow(PAGE, "1", graph, graph.entry)
+        count = await advance_flow(PAGE, "1", payload=flow_button_payload("f", "a", "y"))
+        return count, await session(db)
+
+    assert asyncio.run(run()) == (2, None)
+    assert sent == ["Like it?", "Great", "Bye"]
+
+def test_typed_answer_matches_a_button_title(db, sent):
+    async def run():
+        graph = await save_flow(db, QUESTION)
+        await run_flow(PAGE, "1", graph, graph.entry)
+        server._flow_sessions.clear()  # read the session back from Mongo
+        await server.write_batcher.flush()
+        return await advance_flow(PAGE, "1", text="  no "), await advance_flow(PAGE, "1", text="no")
+
+    assert asyncio.run(run()) == (1, None)
+    assert sent == ["Like it?", "Sorry"]
+
+@pytest.mark.parametrize("payload", [
+    flow_button_payload("f", "a", "missing"),
+    flow_button_payload("missing", "a", "y"),
+    "FLOW:malformed",
+    "SOMETHING_ELSE",
+])
+def test_unknown_payloads_do_not_move_the_flow(db, sent, payload):
+    async def run():
+        await save_flow(db, QUESTION)
+        return await advance_flow(PAGE, "1", payload=payload)
+
+    assert asyncio.run(run()) is None
+    assert sent == []
+
+@pytest.mark.parametrize("fields", [{"page_id": "other-page"}, {"is_active": False}])
+def test_flows_of_other_pages_or_inactive_do_not_run(db, sent, fields):
+    async def run():
+        await save_flow(db, QUESTION, **fields)
+        return await advance_flow(PAGE, "1", payload=flow_button_payload("f", "a", "y"))
+
+    assert asyncio.run(run()) is None
+    assert sent == []
+
+def test_next_step_cycle_is_bounded(db, sent):
+    async def run():
+        graph = await save_flow(db, [message("a", "A", next_step_id="b"), message("b", "B", next_step_id="a")])
+        return await run_flow(PAGE, "1", graph, graph.entry)
+
+    assert asyncio.run(run()) == 2
+    assert sent == ["A", "B"]
@@ -0,0 +1,112 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+import httpx
+import pytest
+
+import server
+from server import CircuitBreaker
+
+
+def graph_batch_client(respond):
+    """Graph client whose batch requests are answered by `respond(recipient_ids)`; returns it and the ids of each request"""
+    requests = []
+
+    def handler(request):
+        batch = json.loads(parse_qs(request.content.decode())["batch"][0])
+        recipient_ids = [json.loads(parse_qs(op["body"])["recipient"][0])["id"] for op in batch]
+        requests.append(recipient_ids)
+        return respond(recipient_ids)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url=server.GRAPH_API_URL)
+    return client, requests
+
+def operation_result(code, body):
+    return {"code": code, "body": json.dumps(body)}
+
+@pytest.fixture
+def graph(monkeypatch):
+    monkeypatch.setattr(server, "GRAPH_RETRY_BASE_SECONDS", 0.001)
+    monkeypatch.setattr(server, "global_circuit", CircuitBreaker(window=server.CIRCUIT_GLOBAL_WINDOW))
+    monkeypatch.setattr(server, "_page_circuits", {})
+    monkeypatch.setattr(server, "_send_rate_limiters", {})
+
+    def use(respond):
+        client, requests = graph_batch_client(respond)
+        monkeypatch.setattr(server, "_graph_client", client)
+        return requests
+    return use
+
+def send_chunk(recipient_ids):
+    messages = [(recipient_id, b'{"text":"hi"}') for recipient_id in recipient_ids]
+    results = [None] * len(messages)
+    page = {"page_id": "P", "access_token": "T"}
+    asyncio.run(server._send_batch_chunk(messages, range(len(messages)), results, page))
+    return results
+
+def test_batch_results_are_split_and_only_retryable_operations_resent(graph):
+    attempts = {}
+
+    def respond(recipient_ids):
+        operations = []
+        for recipient_id in recipient_ids:
+            attempts[recipient_id] = attempts.get(recipient_id, 0) + 1
+            if recipient_id == "ok" or attempts[recipient_id] > 1:
+                operations.append(operation_result(200, {"message_id": f"m-{recipient_id}"}))
+            elif recipient_id == "bad":
+                operations.append(operation_result(400, {"error": {"code": 100, "message": "invalid"}}))
+            elif recipient_id == "flaky":
+                operations.append(operation_result(500, {"error": {"code": 2, "message": "unavailable"}}))
+            else:
+                operations.append(None)
+        return httpx.Response(200, json=operations)
+
+    requests = graph(respond)
+    ok, bad, flaky, skipped = send_chunk(["ok", "bad", "flaky", "skipped"])
+    assert requests == [["ok", "bad", "flaky", "skipped"], ["flaky", "skipped"]]
+    assert ok == {"success": True, "data": {"message_id": "m-ok"}, "attempts": 1}
+    assert not bad["success"] and not bad["retryable"]
+    assert (bad["code"], bad["attempts"]) == (100, 1)
+    assert flaky == {"success": True, "data": {"message_id": "m-flaky"}, "attempts": 2}
+    assert skipped["success"] and skipped["attempts"] == 2
+
+def test_failed_batch_request_retries_every_operation(graph):
+    def respond(recipient_ids):
+        if len(requests) == 1:
+            return httpx.Response(503, json={"error": {"code": 2, "message": "down"}})
+        return httpx.Response(200, json=[operation_result(200, {"message_id": r}) for r in recipient_ids])
+
+    requests = graph(respond)
+    results = send_chunk(["a", "b"])
+    assert requests == [["a", "b"], ["a", "b"]]
+    assert [result["attempts"] for result in results] == [2, 2]
+    assert all(result["success"] for result in results)
+
+def test_batch_gives_up_after_retries(graph):
+    requests = graph(lambda recipient_ids: httpx.Response(200, json=[None] * len(recipient_ids)))
+    [result] = send_chunk(["a"])
+    assert len(requests) == server.GRAPH_SEND_RETRIES + 1
+    assert result["retryable"] and not result["success"]
+    assert result["attempts"] == server.GRAPH_SEND_RETRIES + 1
+
+def test_batch_send_splits_into_graph_sized_requests_and_dead_letters_failures(graph, db, monkeypatch):
+    monkeypatch.setattr(server, "GRAPH_BATCH_SIZE", 2)
+    requests = graph(lambda recipient_ids: httpx.Response(200, json=[
+        operation_result(400, {"error": {"code": 100, "message": "invalid"}}) if r == "c"
+        else operation_result(200, {"message_id": r})
+        for r in recipient_ids
+    ]))
+    dead_letter = {"user_id": "U", "page_id": "P", "broadcast_id": "B", "source": "broadcast"}
+
+    async def run():
+        results = await server.send_message_batch(
+            [(r, b'{"text":"hi"}') for r in "abcde"], {"page_id": "P", "access_token": "T"}, dead_letter
+        )
+        await server.write_batcher.flush()
+        return results, await db.dead_letters.find({}, {"_id": 0}).to_list(10)
+
+    results, letters = asyncio.run(run())
+    assert requests == [["a", "b"], ["c", "d"], ["e"]]
+    assert [result["success"] for result in results] == [True, True, False, True, True]
+    assert [(letter["recipient_id"], letter["code"], letter["retryable"]) for letter in letters] == [("c", 100, False)]
@@ -0,0 +1,24 @@
+import asyncio
+
+import pytest
+
+from server import ensure_indexes
+
+
+def test_indexes_are_created(db):
+    asyncio.run(ensure_indexes())
+    info = asyncio.run(db.subscribers.index_information())
+    assert info["page_id_1_psid_1"]["unique"]
+    assert "page_id_1_subscribed_1_psid_1" in info
+
+def test_duplicates_fail_startup_but_not_the_other_indexes(db):
+    async def run():
+        await db.subscribers.insert_many([{"id": "a", "page_id": "P", "psid": "1"}, {"id": "b", "page_id": "P", "psid": "1"}])
+        with pytest.raises(RuntimeError, match="subscribers.page_id_1_psid_1"):
+            await ensure_indexes()
+        return await db.subscribers.index_information(), await db.users.index_information()
+
+    subscribers, users = asyncio.run(run())
+    assert "page_id_1_psid_1" not in subscribers
+    assert "page_id_1_subscribed_1_psid_1" in subscribers
+    assert "email_1" in users
@@ -0,0 +1,39 @@
+import random
+
+import pytest
+
+from server import KeywordMatcher
+
+
+def automation(keyword, flow_id=None):
+    return {"trigger": {"keyword": keyword}, "flow_id": flow_id or keyword}
+
+@pytest.mark.parametrize("keywords,text", [
+    (["price", "hi", "hello"], "Hello, what is the PRICE?"),
+    (["he", "she", "his", "hers"], "ushers"),
+    (["abcd", "bc", "c"], "abc"),
+    (["aa", "aaa"], "aaaa"),
+    (["sale"], "nothing here"),
+    (["مرحبا", "hi"], "مرحبا بك"),
+])
+def test_keyword_matcher_agrees_with_substring_search(keywords, text):
+    automations = [automation(keyword) for keyword in keywords]
+    expected = [a for a in automations if a["trigger"]["keyword"].lower() in text.lower()]
+    assert KeywordMatcher(automations).match(text) == expected
+
+def test_keyword_matcher_returns_each_automation_once_in_given_order():
+    automations = [automation("b", "first"), automation("a", "second"), automation("A", "third")]
+    assert KeywordMatcher(automations).match("a b a b") == automations
+
+def test_keyword_matcher_ignores_automations_without_keyword():
+    automations = [{"trigger": {}, "flow_id": "f"}, automation("", "g")]
+    assert KeywordMatcher(automations).match("anything") == []
+
+def test_keyword_matcher_agrees_with_substring_search_on_random_input():
+    rng = random.Random(6)
+    for _ in range(200):
+        keywords = ["".join(rng.choices("abA", k=rng.randint(1, 4))) for _ in range(rng.randint(1, 8))]
+        text = "".join(rng.choices("abA ", k=rng.randint(0, 30)))
+        automations = [automation(keyword, str(i)) for i, keyword in enumerate(keywords)]
+        expected = [a for a in automations if a["trigger"]["keyword"].lower() in text.lower()]
+        assert KeywordMatcher(automations).match(text) == expected
@@ -0,0 +1,28 @@
+import json
+
+from server import MessageTemplate
+
+
+def test_message_template_escapes_placeholder_values():
+    template = MessageTemplate({"text": "Hi {first_name} {last_name}!"})
+    body = template.render({"first_name": 'Jo "JJ" \\ \n', "last_name": "مرحبا"})
+    assert json.loads(body) == {"text": 'Hi Jo "JJ" \\ \n مرحبا!'}
+
+def test_message_template_renders_missing_values_empty():
+    template = MessageTemplate({"text": "Hi {first_name}{last_name}"})
+    assert json.loads(template.render({"last_name": None})) == {"text": "Hi "}
+
+def test_message_template_without_placeholders_reuses_body():
+    template = MessageTemplate({"text": "Hi {nickname}"})
+    assert template.fields == []
+    assert template.render({"nickname": "x"}) is template.body
+
+def test_placeholder_in_a_value_is_not_expanded_again():
+    template = MessageTemplate({"text": "{first_name}/{last_name}"})
+    assert json.loads(template.render({"first_name": "{last_name}", "last_name": "L"})) == {"text": "{last_name}/L"}
+
+def test_placeholders_inside_nested_payloads():
+    template = MessageTemplate({"attachment": {"payload": {"elements": [{"title": "Hi {first_name}", "subtitle": "x"}]}}})
+    assert template.fields == ["first_name"]
+    rendered = json.loads(template.render({"first_name": "Ann"}))
+    assert rendered["attachment"]["payload"]["elements"][0]["title"] == "Hi Ann"
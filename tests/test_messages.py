@@ -0,0 +1,76 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+from server import User, get_messages
+
+USER = User(id="U", email="a@example.com", name="A")
+BASE = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def history(db):
+    """Seven messages one second apart, at half-past each second; m3 and m4 share a timestamp"""
+    seconds = [0, 1, 2, 3, 3, 5, 6]
+    messages = [
+        {"id": f"m{i}", "subscriber_id": "S", "page_id": "P", "created_at": (BASE + timedelta(seconds=s, microseconds=500000)).isoformat()}
+        for i, s in enumerate(seconds)
+    ]
+
+    async def seed():
+        await db.subscribers.insert_one({"id": "S", "user_id": "U", "page_id": "P"})
+        await db.messages.insert_many([dict(message) for message in messages])
+    asyncio.run(seed())
+    return messages
+
+def fetch(**params):
+    response = asyncio.run(get_messages(subscriber_id=params.pop("subscriber_id", "S"), current_user=USER, **{
+        "before": None, "after": None, "since": None, "limit": 50, **params
+    }))
+    return json.loads(response.body)
+
+def ids(page):
+    return [message["id"] for message in page["items"]]
+
+def test_pages_back_through_history_with_before(history):
+    page = fetch(limit=3)
+    assert (ids(page), page["has_more"]) == (["m6", "m5", "m4"], True)
+    page = fetch(limit=3, before=page["next_before"])
+    assert (ids(page), page["has_more"]) == (["m3", "m2", "m1"], True)
+    page = fetch(limit=3, before=page["next_before"])
+    assert (ids(page), page["has_more"], page["next_before"]) == (["m0"], False, None)
+
+def test_after_returns_the_next_newer_messages(history):
+    oldest = fetch(limit=3, before=fetch(limit=4)["next_before"])
+    assert ids(oldest) == ["m2", "m1", "m0"]
+    page = fetch(limit=3, after=oldest["next_after"])
+    assert ids(page) == ["m5", "m4", "m3"]
+    page = fetch(limit=3, after=page["next_after"])
+    assert (ids(page), page["has_more"]) == (["m6"], False)
+    assert fetch(after=page["next_after"])["items"] == []
+
+@pytest.mark.parametrize("since", [
+    "2026-01-01T00:00:02Z",
+    "2026-01-01T00:00:02+00:00",
+    "2026-01-01T00:00:02",
+    "2026-01-01T02:00:02+02:00",
+    "2026-01-01T00:00:02.000000+00:00",
+])
+def test_since_accepts_any_iso_format(history, since):
+    page = fetch(since=since)
+    assert ids(page) == ["m2", "m3", "m4", "m5", "m6"]
+    assert fetch(since=page["items"][-1]["created_at"])["items"] == []
+
+@pytest.mark.parametrize("params,status", [
+    ({"since": "yesterday"}, 400),
+    ({"since": "2026-01-01T00:00:00Z", "before": "x"}, 400),
+    ({"before": "not-a-cursor"}, 400),
+    ({"subscriber_id": "someone-elses"}, 404),
+])
+def test_invalid_requests(history, params, status):
+    with pytest.raises(HTTPException) as exc:
+        fetch(**params)
+    assert exc.value.status_code == status
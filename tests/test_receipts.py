@@ -0,0 +1,64 @@
+import asyncio
+
+from server import ReceiptAggregator
+
+
+async def seed(db, messages):
+    await db.broadcasts.insert_many([{"id": "B1", "delivered_count": 0, "read_count": 0}, {"id": "B2", "delivered_count": 0, "read_count": 0}])
+    await db.broadcast_messages.insert_many([
+        {"mid": mid, "broadcast_id": broadcast_id, "page_id": "P", "psid": psid, "sent_at": sent_at, "delivered": delivered, "read": False}
+        for mid, broadcast_id, psid, sent_at, delivered in messages
+    ])
+
+async def counts(db):
+    return {
+        broadcast["id"]: (broadcast["delivered_count"], broadcast["read_count"])
+        async for broadcast in db.broadcasts.find({}, {"_id": 0})
+    }
+
+def test_deliveries_are_counted_once_per_message(db):
+    async def run():
+        await seed(db, [("m1", "B1", "1", 100, False), ("m2", "B1", "2", 100, False), ("m3", "B2", "3", 100, False)])
+        aggregator = ReceiptAggregator()
+        aggregator.add_delivery(["m1", "m2", "unknown"])
+        aggregator.add_delivery(["m1", "m3"])
+        await aggregator.flush()
+        # Facebook redelivers the receipt; another process flushes it again
+        for _ in range(2):
+            other = ReceiptAggregator()
+            other.add_delivery(["m1"])
+            await other.flush()
+        return await counts(db)
+
+    assert asyncio.run(run()) == {"B1": (2, 0), "B2": (1, 0)}
+
+def test_read_watermark_marks_earlier_messages_read_and_delivered(db):
+    async def run():
+        await seed(db, [
+            ("m1", "B1", "1", 100, False),
+            ("m2", "B2", "1", 150, True),
+            ("m3", "B2", "1", 300, False),
+            ("m4", "B1", "2", 100, False),
+        ])
+        aggregator = ReceiptAggregator()
+        aggregator.add_read("P", "1", 120)
+        aggregator.add_read("P", "1", 200)
+        await aggregator.flush()
+        aggregator.add_read("P", "1", 200)
+        await aggregator.flush()
+        return await counts(db), await db.broadcast_messages.find({"read": True}, {"_id": 0, "mid": 1}).to_list(10)
+
+    totals, read = asyncio.run(run())
+    # m1 was never delivery-receipted, so its read also counts as a delivery; m2 was already delivered
+    assert totals == {"B1": (1, 1), "B2": (0, 1)}
+    assert sorted(message["mid"] for message in read) == ["m1", "m2"]
+
+def test_flush_clears_the_buffer(db):
+    async def run():
+        aggregator = ReceiptAggregator()
+        aggregator.add_delivery(["m1"])
+        aggregator.add_read("P", "1", 1)
+        await aggregator.flush()
+        return aggregator.delivered, aggregator.read, aggregator.wakeup.is_set()
+
+    assert asyncio.run(run()) == (set(), {}, False)
@@ -0,0 +1,40 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from server import User, decode_cursor, encode_cursor, get_subscribers
+
+
+def test_cursor_round_trip():
+    token = encode_cursor("2026-01-01T00:00:00+00:00", "id/with+chars")
+    assert decode_cursor(token, 2) == ["2026-01-01T00:00:00+00:00", "id/with+chars"]
+
+@pytest.mark.parametrize("token", ["not base64!", encode_cursor("only-one"), "e30="])
+def test_invalid_cursor_is_rejected(token):
+    with pytest.raises(HTTPException) as exc:
+        decode_cursor(token, 2)
+    assert exc.value.status_code == 400
+
+async def page_through(user, page_id=None, limit=3):
+    seen, after = [], None
+    while True:
+        response = await get_subscribers(page_id=page_id, after=after, limit=limit, format="json", current_user=user)
+        body = json.loads(response.body)
+        seen += [item["id"] for item in body["items"]]
+        after = body["next_after"]
+        if after is None:
+            return seen
+
+def test_subscribers_page_through_ties_on_created_at(db):
+    user = User(email="a@example.com", name="A")
+    docs = [
+        {"id": f"s{i}", "user_id": user.id, "page_id": "P" if i % 2 else "Q", "created_at": f"2026-01-0{i // 3 + 1}"}
+        for i in range(8)
+    ]
+    others = [{"id": "x", "user_id": "someone-else", "page_id": "P", "created_at": "2026-01-01"}]
+    asyncio.run(db.subscribers.insert_many([dict(doc) for doc in docs + others]))
+
+    assert asyncio.run(page_through(user)) == [doc["id"] for doc in docs]
+    assert asyncio.run(page_through(user, "P", limit=2)) == [doc["id"] for doc in docs if doc["page_id"] == "P"]
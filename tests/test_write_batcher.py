@@ -0,0 +1,92 @@
+import asyncio
+
+import server
+from server import WriteBatcher
+
+
+class FakeCollection:
+    def __init__(self, delays=()):
+        self.writes = []
+        self.delays = list(delays)
+
+    async def bulk_write(self, operations, ordered=True):
+        delay = self.delays.pop(0) if self.delays else 0
+        await asyncio.sleep(delay)
+        self.writes.append(operations)
+        return len(operations)
+
+def test_write_batcher_merges_operations_by_key(monkeypatch):
+    collection = FakeCollection()
+    monkeypatch.setattr(server, "db", {"things": collection})
+
+    async def run():
+        batcher = WriteBatcher(max_size=100, max_delay=60)
+        first = batcher.add("things", "first", key="k")
+        batcher.add("things", "other")
+        last = batcher.add("things", "last", key="k")
+        await batcher.flush()
+        return await first, await last
+
+    assert asyncio.run(run()) == (2, 2)
+    assert collection.writes == [["other", "last"]]
+
+def test_write_batcher_sums_increments_of_a_document(monkeypatch):
+    collection = FakeCollection()
+    monkeypatch.setattr(server, "db", {"stats": collection})
+
+    async def run():
+        batcher = WriteBatcher(max_size=100, max_delay=60)
+        batcher.increment("stats", {"page_id": "P"}, {"sent": 1, "failed": 1}, {"created": "now"})
+        batcher.increment("stats", {"page_id": "P"}, {"sent": 2})
+        batcher.increment("stats", {"page_id": "Q"}, {"sent": 5})
+        await batcher.flush()
+
+    asyncio.run(run())
+    [[p, q]] = collection.writes
+    assert p._filter == {"page_id": "P"}
+    assert p._doc == {"$inc": {"sent": 3, "failed": 1}, "$setOnInsert": {"created": "now"}}
+    assert p._upsert
+    assert q._doc == {"$inc": {"sent": 5}}
+
+def test_write_batcher_flushes_in_order(monkeypatch):
+    # The first flush is slow; a later write to the same key must still land after it
+    collection = FakeCollection(delays=[0.05, 0])
+    monkeypatch.setattr(server, "db", {"things": collection})
+
+    async def run():
+        batcher = WriteBatcher(max_size=100, max_delay=60)
+        batcher.add("things", "v1", key="k")
+        first = asyncio.ensure_future(batcher.flush())
+        await asyncio.sleep(0)
+        batcher.add("things", "v2", key="k")
+        await asyncio.gather(first, batcher.flush())
+
+    asyncio.run(run())
+    assert collection.writes == [["v1"], ["v2"]]
+
+def test_write_batcher_schedules_one_flush_while_one_is_running(monkeypatch):
+    collection = FakeCollection(delays=[0.05])
+    monkeypatch.setattr(server, "db", {"things": collection})
+
+    async def run():
+        batcher = WriteBatcher(max_size=2, max_delay=60)
+        futures = [batcher.add("things", i) for i in range(2)]
+        await asyncio.sleep(0.01)  # the first flush is now writing
+        futures += [batcher.add("things", i) for i in range(2, 1000)]
+        scheduled = len(batcher._flushing)
+        await asyncio.gather(*futures)
+        return scheduled
+
+    assert asyncio.run(run()) == 2
+    assert collection.writes == [[0, 1], list(range(2, 1000))]
+
+def test_write_batcher_flushes_after_delay(monkeypatch):
+    collection = FakeCollection()
+    monkeypatch.setattr(server, "db", {"things": collection})
+
+    async def run():
+        batcher = WriteBatcher(max_size=100, max_delay=0.01)
+        await batcher.add("things", "a")
+
+    asyncio.run(run())
+    assert collection.writes == [["a"]]